@@ -0,0 +1,76 @@
+import numpy as np
+
+# Mark-to-market accounting of a backtest from its trade log (see trade_log.py): per bar position, average price,
+# realized and unrealized PnL and equity, then the summary statistics used to rank configurations.
+# Everything is computed with cumulative sums over the trades and one searchsorted to spread them
+# over the bars, there is no Python loop over bars or trades.
+
+INITIAL_CASH = 100000
+
+# Forex trades around the clock five days a week, used to annualize the per bar Sharpe ratio.
+SECONDS_PER_YEAR = 260 * 24 * 3600
+
+# Positions smaller than this are flat (the take profit size is rounded to 4 decimals).
+FLAT = 1e-6
+
+
+def trade_arrays(trade_log):
+    # Bar index, signed quantity (positive when buying) and price of every trade.
+    steps, _, prices, sizes, _ = trade_log.columns()
+    return steps, np.where(trade_log.buys(), sizes, -sizes), prices
+
+def account(closes, trade_log, cash=INITIAL_CASH, start=0, end=None):
+    # Accounting of the trades over the bars [start, end), marked to market at the closes.
+    # Return the per bar arrays (position, average_price, realized_pnl, unrealized_pnl, equity)
+    # and the realized PnL of every closed ladder (a ladder is closed when the position is flat again).
+    end = len(closes) if end is None else end
+    steps, quantities, prices = trade_arrays(trade_log)
+
+    # State before any trade, then after each trade.
+    position = np.concatenate(([0.0], np.cumsum(quantities)))
+    flat = np.abs(position) < FLAT
+    position[flat] = 0.0
+    cost = np.concatenate(([0.0], np.cumsum(quantities * prices))) # Cash paid for the trades so far
+    closed_cost = cost[np.maximum.accumulate(np.where(flat, np.arange(len(cost)), 0))] # ... for the closed ladders
+    ladder_pnls = -np.diff(cost[flat])
+
+    # State at the close of each bar, after the last trade of the bar or before.
+    last_trade = np.searchsorted(steps, np.arange(start, end), side="right")
+    bar_position = position[last_trade]
+    bar_open_cost = (cost - closed_cost)[last_trade]
+    bar_realized = -closed_cost[last_trade]
+
+    unrealized = bar_position * closes[start:end] - bar_open_cost
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_price = np.where(bar_position != 0, bar_open_cost / bar_position, np.nan)
+    curve = {
+        "position": bar_position,
+        "average_price": average_price,
+        "realized_pnl": bar_realized,
+        "unrealized_pnl": unrealized,
+        "equity": cash + bar_realized + unrealized,
+    }
+    return curve, ladder_pnls
+
+def statistics(curve, ladder_pnls, bar_seconds, cash=INITIAL_CASH):
+    # Summary of an equity curve: PnL, max drawdown (fraction of the peak equity), annualized
+    # Sharpe ratio of the per bar returns, win rate of the closed ladders and time in market.
+    equity = curve["equity"]
+    if len(equity) == 0:
+        return {"total_pnl": 0.0, "max_drawdown": 0.0, "sharpe": np.nan, "win_rate": np.nan, "time_in_market": 0.0, "ladders_closed": 0}
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    returns = np.diff(equity) / equity[:-1]
+    deviation = returns.std() if len(returns) else 0.0
+    sharpe = returns.mean() / deviation * np.sqrt(SECONDS_PER_YEAR / bar_seconds) if deviation > 0 else np.nan
+    return {
+        "total_pnl": float(equity[-1] - cash),
+        "max_drawdown": float(drawdown.max()),
+        "sharpe": float(sharpe),
+        "win_rate": float((ladder_pnls > 0).mean()) if len(ladder_pnls) else np.nan,
+        "time_in_market": float((curve["position"] != 0).mean()),
+        "ladders_closed": len(ladder_pnls),
+    }
+
+def backtest_statistics(closes, trade_log, bar_seconds, cash=INITIAL_CASH, start=0, end=None):
+    curve, ladder_pnls = account(closes, trade_log, cash, start, end)
+    return statistics(curve, ladder_pnls, bar_seconds, cash)
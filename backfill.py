@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import os
+import sys
+import time
+import numpy as np
+from ib_insync import RequestError, util
+from bar_cache import BAR_DTYPE, CACHE_DIR, bars_to_records, cache_path, covered_since, merge_bars, parse_bar_size, parse_duration, set_covered_since, to_duration
+from backtest import print_strings, boot_IB, get_config, get_contract
+from logger import log
+import logger
+import settings
+
+# Bulk download of a long history into the bar cache, for backtests longer than one IB request.
+# The date range is split into chunks of the longest duration IB serves for the bar size, and the
+# chunks are requested concurrently while staying within the IB pacing limits:
+#   python backfill.py --start 2021-01-01            # up to now
+#   python backfill.py --set durationStr="3 Y"       # the durationStr window
+# Every chunk received is written to its own file in <cache file>.backfill/, the manifest of the
+# chunks already downloaded: an interrupted backfill started again only requests the missing chunks.
+# Once every chunk is there, they are merged into the cache, sorted and without duplicate bars.
+
+# Longest durationStr of one request for the smallest bar sizes it allows, in seconds.
+# https://interactivebrokers.github.io/tws-api/historical_limitations.html
+MAX_DURATIONS = [(1, "1800 S"), (5, "3600 S"), (10, "14400 S"), (30, "28800 S"), (60, "1 D"), (120, "2 D"), (180, "1 W"), (1800, "1 M"), (86400, "1 Y")]
+
+# IB pacing limits of historical data requests: at most 6 requests for a contract within 2 seconds,
+# and for bars of 30 seconds or less at most 60 requests within 10 minutes.
+BURST_REQUESTS, BURST_SECONDS = 6, 2
+SMALL_BAR_SECONDS = 30
+PERIOD_REQUESTS, PERIOD_SECONDS = 60, 600
+
+# Requests in flight at once, and retries of a chunk before giving up (it is retried by the next run).
+CONCURRENCY = 6
+MAX_ATTEMPTS = 5
+PACING_BACKOFF = 10 # Seconds to wait after a pacing violation.
+
+
+class Pacer:
+    # Delays requests so that at most burst requests start within burst_seconds and, when
+    # period_requests is set, at most period_requests within period_seconds.
+    # Every request awaits wait() before being sent, from coroutines running on the same event loop.
+
+    def __init__(self, burst=BURST_REQUESTS, burst_seconds=BURST_SECONDS, period_requests=None, period_seconds=PERIOD_SECONDS):
+        self.burst = burst
+        self.burst_seconds = burst_seconds
+        self.period_requests = period_requests
+        self.period_seconds = period_seconds
+        self.sent = collections.deque(maxlen=max(burst, period_requests or 0)) # Start time of the last requests
+
+    def delay(self, now):
+        # Seconds to wait before the next request can start.
+        delay = 0.0
+        if len(self.sent) >= self.burst:
+            delay = self.sent[-self.burst] + self.burst_seconds - now
+        if self.period_requests and len(self.sent) >= self.period_requests:
+            delay = max(delay, self.sent[-self.period_requests] + self.period_seconds - now)
+        return delay
+
+    async def wait(self):
+        while True:
+            now = time.monotonic()
+            delay = self.delay(now)
+            if delay <= 0:
+                self.sent.append(now)
+                return
+            await asyncio.sleep(delay)
+
+def max_duration(barSizeSetting):
+    # Longest durationStr IB serves in one request for barSizeSetting, in seconds.
+    bar_seconds = parse_bar_size(barSizeSetting)
+    duration = MAX_DURATIONS[0][1]
+    for min_bar_seconds, durationStr in MAX_DURATIONS:
+        if bar_seconds >= min_bar_seconds:
+            duration = durationStr
+    return parse_duration(duration)
+
+def make_chunks(start, end, barSizeSetting):
+    # Split [start, end) (seconds since epoch) into the (start, end) ranges of one request each.
+    # Chunks are aligned on multiples of the chunk duration, so a backfill started again later
+    # (with a later end) finds the same chunks, only the last one changes.
+    duration = max_duration(barSizeSetting)
+    chunks = []
+    chunk_start = start - start % duration
+    while chunk_start < end:
+        chunks.append((max(chunk_start, start), min(chunk_start + duration, end)))
+        chunk_start += duration
+    return chunks
+
+def chunk_file(spool, chunk):
+    return os.path.join(spool, f"{chunk[0]}_{chunk[1]}.bars")
+
+def read_chunks(spool):
+    # Bars of every chunk downloaded, in chunk order (a longer chunk after a shorter one with the same start).
+    names = sorted((name for name in os.listdir(spool) if name.endswith(".bars")), key=lambda name: tuple(int(value) for value in name[:-5].split("_")))
+    return [np.fromfile(os.path.join(spool, name), dtype=BAR_DTYPE) for name in names]
+
+async def fetch_chunk(ib, contract, barSizeSetting, whatToShow, chunk, spool, pacer, semaphore):
+    # Download the bars of chunk into its file. Return the number of bars, None if every attempt failed.
+    chunk_start, chunk_end = chunk
+    for attempt in range(MAX_ATTEMPTS):
+        backoff = PACING_BACKOFF * (attempt + 1)
+        async with semaphore:
+            await pacer.wait()
+            try:
+                bars = await ib.reqHistoricalDataAsync(
+                    contract, endDateTime=datetime.datetime.fromtimestamp(chunk_end, datetime.timezone.utc),
+                    durationStr=to_duration(chunk_end - chunk_start), barSizeSetting=barSizeSetting,
+                    whatToShow=whatToShow, useRTH=0, formatDate=2)
+            except RequestError as error:
+                if error.code == 162 and "no data" in error.message:
+                    bars = [] # Nothing traded in the chunk (weekend, holidays).
+                else:
+                    log.warning("Backfill request %s - %s failed: %s", chunk_start, chunk_end, error.message)
+                    bars = None
+            else:
+                if not bars: # Request timed out, ib_insync returns no bars.
+                    log.warning("Backfill request %s - %s timed out", chunk_start, chunk_end)
+                    bars = None
+        if bars is None:
+            await asyncio.sleep(backoff)
+            continue
+
+        # IB may return bars around the chunk, they belong to the neighbouring chunks.
+        records = bars_to_records(bars)
+        records = records[(records["date"] >= chunk_start) & (records["date"] < chunk_end)]
+        path = chunk_file(spool, chunk)
+        records.tofile(path + ".tmp")
+        os.replace(path + ".tmp", path) # The chunk only counts as downloaded once complete.
+        log.info("Backfill %s - %s: %s bars", datetime.datetime.fromtimestamp(chunk_start, datetime.timezone.utc),
+                 datetime.datetime.fromtimestamp(chunk_end, datetime.timezone.utc), len(records))
+        return len(records)
+    return None
+
+async def backfill(ib, contract, config, start, end, whatToShow='MIDPOINT', cache_dir=None, concurrency=CONCURRENCY, pacer=None):
+    # Download the bars of [start, end) (seconds since epoch) into the cache of the pair, in the
+    # Base_barSizeSetting bars when set (the bars get_bars downloads), barSizeSetting otherwise.
+    # Return a summary: chunks of the range, chunks downloaded, chunks failed and bars in the cache.
+    barSizeSetting = config.get("Base_barSizeSetting") or config["barSizeSetting"]
+    path = cache_path(config["pair"], barSizeSetting, whatToShow, cache_dir or CACHE_DIR)
+    spool = os.path.splitext(path)[0] + ".backfill"
+    os.makedirs(spool, exist_ok=True)
+    if pacer is None:
+        small_bars = parse_bar_size(barSizeSetting) <= SMALL_BAR_SECONDS
+        pacer = Pacer(period_requests=PERIOD_REQUESTS if small_bars else None)
+
+    chunks = make_chunks(start, end, barSizeSetting)
+    pending = [chunk for chunk in chunks if not os.path.exists(chunk_file(spool, chunk))]
+    print_strings(f"Backfilling {config['pair']} {barSizeSetting}: {len(chunks)} chunks, {len(chunks) - len(pending)} already downloaded")
+
+    # Requests raise RequestError instead of logging the error and returning no bars.
+    raise_request_errors = ib.RaiseRequestErrors
+    ib.RaiseRequestErrors = True
+    try:
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(*(fetch_chunk(ib, contract, barSizeSetting, whatToShow, chunk, spool, pacer, semaphore) for chunk in pending))
+    finally:
+        ib.RaiseRequestErrors = raise_request_errors
+
+    summary = {"chunks": len(chunks), "downloaded": sum(result is not None for result in results), "failed": sum(result is None for result in results), "bars": None}
+    if summary["failed"]:
+        print_strings(f"{summary['failed']} chunks failed, run the backfill again to download them")
+        return summary
+
+    chunk_records = read_chunks(spool)
+    since = covered_since(path)
+    summary["bars"] = merge_bars(path, np.concatenate(chunk_records) if chunk_records else np.empty(0, dtype=BAR_DTYPE))
+    if since is None or end >= since: # No gap between the backfill and the bars already cached.
+        set_covered_since(path, min(start, since) if since is not None else start)
+    for name in os.listdir(spool):
+        os.remove(os.path.join(spool, name))
+    os.rmdir(spool)
+    print_strings(f"Backfill completed, {summary['bars']} bars cached in {path}")
+    return summary
+
+def parse_date(value):
+    # "2021-01-01" or "2021-01-01 12:00" (UTC) -> seconds since epoch.
+    return int(datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def simulate(config, bars=20000, barSizeSeconds=600):
+    # Backfill synthetic bars from the simulated broker (sim_broker.py), serving them with some
+    # latency and refusing requests past the IB burst limit, then check the cache against them.
+    # Pacing is 10 times faster than IB so that the run only takes a few seconds.
+    import tempfile
+    from sim_broker import SimIB, synthetic_bars
+    data = synthetic_bars(bars, barSizeSeconds=barSizeSeconds, seed=1)
+    ib = SimIB({config["pair"]: data}, start=bars - 1, history_latency=0.05, history_pacing=(BURST_REQUESTS, BURST_SECONDS / 10))
+    config = dict(config, barSizeSetting=f"{barSizeSeconds // 60} mins", Base_barSizeSetting="")
+    cache_dir = tempfile.mkdtemp()
+    dates = ib.data[config["pair"]]["date"]
+    summary = util.run(backfill(ib, get_contract(config), config, int(dates[0]), int(dates[-1]) + barSizeSeconds,
+                                cache_dir=cache_dir, pacer=Pacer(burst_seconds=BURST_SECONDS / 10)))
+    cached = np.fromfile(cache_path(config["pair"], config["barSizeSetting"], "MIDPOINT", cache_dir), dtype=BAR_DTYPE)
+    matches = len(cached) == len(data) and (cached["date"] == dates).all() and (cached["close"] == data["close"].to_numpy()).all()
+    print_strings(f"{summary}, {len(ib.history_requests)} requests, {ib.pacing_violations} pacing violations, cache matches the bars: {matches}")
+    return 0 if matches else 1
+
+def main(argv=None):
+    # Command line entry point. Return the process exit code.
+    parser = argparse.ArgumentParser(description="Download a long history of bars into the bar cache.")
+    parser.add_argument("--config", default="config.json", help="configuration file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a configuration setting")
+    parser.add_argument("--start", help="first date (UTC), default: durationStr before the end")
+    parser.add_argument("--end", help="end date (UTC), default: now")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help=f"requests in flight at once (default {CONCURRENCY})")
+    parser.add_argument("--sim", action="store_true", help="backfill synthetic bars from the simulated broker")
+    parser.add_argument("--host", help="IB Gateway host (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="IB Gateway port (default 7497)")
+    parser.add_argument("--client-id", type=int, help="IB client id (default 1)")
+    args = parser.parse_args(argv)
+
+    config = get_config(args.config, settings.parse_overrides(args.set)) # Read configuration parameters from config.json.
+    if config is None:
+        return 1
+    logger.configure(config.get("Log_level"))
+    if args.sim:
+        return simulate(config)
+
+    end = parse_date(args.end) if args.end else int(time.time())
+    start = parse_date(args.start) if args.start else end - parse_duration(config["durationStr"])
+    myAccount, ib = boot_IB(args.host, args.port, args.client_id) # Get IB gateaway established.
+    if ib is None:
+        return 1
+    contract = get_contract(config)
+    if contract is None:
+        return 1
+    try:
+        summary = util.run(backfill(ib, contract, config, start, end, concurrency=args.concurrency))
+    finally:
+        ib.disconnect()
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
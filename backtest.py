@@ -1,33 +1,42 @@
 from ib_insync import *
-from ta.momentum import RSIIndicator
-from ta.trend import SMAIndicator
-from ta.volatility import BollingerBands
-from pyfiglet import Figlet
-import plotly.graph_objects as go
-import datetime
-import json
+from bar_cache import get_bars, parse_bar_size
+from accounting import INITIAL_CASH, backtest_statistics
+from fibonacci import ladder_template, ladder_prices
+from plotting import plot_trades
+from trade_log import TradeLog
+from indicators import IndicatorStream, compute_signals, detect_cross, detect_RSI, detect_bollinger, get_order_type
+from logger import log, backtest_log
+import logger
+import settings
+import argparse
+import sys
+import logging
+import numpy as np
 
 def welcome():
     # Initial logging.
+    from pyfiglet import Figlet # Only needed for the banner
     f = Figlet(font='small')
     print(f.renderText('404 Profit Not Found'))
     print("\n\n\nWelcome to the trading bot, remember to open your IB Gateway before running the bot!")
     input("Press enter to continue...")
     print("\n\n\n")
 
-def print_strings(string):
-    # Fuction for logging management. 
-    print("["+str(datetime.datetime.now())+"]\t"+string)
+def print_strings(string, *args):
+    # Fuction for logging management, the message is written by the background logger.
+    log.info(string, *args)
 
 def print_index(index, string):
     print(f"[ {index}]\t"+string)
 
-def boot_IB():
+def boot_IB(host=None, port=None, clientId=None):
     #Function for trying to establish connection with IB Gateway. 
+    #Connection settings not given are read from the environment (see settings.py).
+    host, port, clientId = settings.ib_connection(host, port, clientId)
     try:
         print_strings("IB Gateway connecting...")
         ib = IB()
-        ib.connect('127.0.0.1', 7497, clientId=1)
+        ib.connect(host, port, clientId=clientId)
         myAccount = ib.accountSummary()
         print_strings("IB Gateway connected")
         return myAccount, ib
@@ -35,12 +44,12 @@ def boot_IB():
         print_strings("Error connecting to IB Gateway")
         return None, None
     
-def get_config():
-    # Load configuration settings from config.json.
+def get_config(path='config.json', overrides=None):
+    # Load configuration settings from config.json, overridden by the TRADING_BOT_* 
+    # environment variables and the given overrides.
     print_strings("Loading config file...")
     try:
-        with open('config.json') as f:
-            config = json.load(f)
+        config = settings.load_config(path, overrides)
         print_strings("Config file loaded")
 
         # Check if Martingale_Max is less or equal than a constant (5).
@@ -68,11 +77,8 @@ def get_data(config, ib, contract):
     # Documentation can be found here: https://interactivebrokers.github.io/tws-api/historical_bars.html
     print_strings("Retrieving data from IB for "+config["pair"]+"...")
     try:
-        bars = ib.reqHistoricalData(
-            contract, endDateTime= '', durationStr=config["durationStr"],
-            barSizeSetting=config["barSizeSetting"], whatToShow='MIDPOINT', useRTH=0
-        )
-        myData = util.df(bars)
+        # Bars already stored in the local cache are not downloaded again.
+        myData = get_bars(ib, contract, config, whatToShow='MIDPOINT')
         if myData.empty:
             raise ValueError("Retrieved data is empty")
         print_strings("Historical data for "+config["pair"]+" downloaded")
@@ -82,439 +88,324 @@ def get_data(config, ib, contract):
 
     return myData
 
-def detect_cross(sma_small, sma_big):
-    # Detect MA indicator based on config.json parameters. 
-    if sma_small.iloc[-1] > sma_big.iloc[-1] and sma_small.iloc[-2] < sma_big.iloc[-2]:
-        return -1  
-    elif sma_small.iloc[-1] < sma_big.iloc[-1] and sma_small.iloc[-2] > sma_big.iloc[-2]:
-        return 1 
-    return 0
-
-def detect_RSI(RSI_series, config):
-    # Detect RSI indicator based on config.json parameters.
-    if RSI_series.iloc[-1] > config["RSI_high"]:
-        return 1 
-    elif RSI_series.iloc[-1] < config["RSI_low"]:
-        return -1
-    return 0
-
-def detect_bollinger(data, Bollinger_H_series, Bollinger_L_series):
-    # Detect Bollinger indicator based on config.json parameters. 
-    if data['close'].iloc[-1] > Bollinger_H_series.iloc[-1]:
-        return 1
-    elif data['close'].iloc[-1] < Bollinger_L_series.iloc[-1]:
-        return -1
-    return 0
-
-def backtest_strategy(config, historical_data):
-    
-    def calculate_indicators(current_data):
-        # Load indicator parameters from config.json.
-        sma_small_duration = config["SMA_small_duration"]
-        sma_big_duration = config["SMA_big_duration"]
-        rsi_duration = config["RSI_duration"]
-        bollinger_band_duration = config["bolinger_band_duration"]
-        bollinger_band_std_dev = config["bolinger_band_std_dev"]
-
-        # Calculate indicators with ta library.
-        # Documentation can be found here: https://technical-analysis-library-in-python.readthedocs.io/en/latest/
-        sma_small = SMAIndicator(close=current_data['close'], window=sma_small_duration).sma_indicator()
-        sma_big = SMAIndicator(close=current_data['close'], window=sma_big_duration).sma_indicator()
-        rsi = RSIIndicator(close=current_data['close'], window=rsi_duration).rsi()
-        bollinger = BollingerBands(
-            close=current_data['close'],
-            window=bollinger_band_duration,
-            window_dev=bollinger_band_std_dev
-        )
-        bollinger_h = bollinger.bollinger_hband()
-        bollinger_l = bollinger.bollinger_lband()
-
-        return sma_small, sma_big, rsi, bollinger_h, bollinger_l
-
-    def get_fibonacci_levels(current_data, config, fill_price):
-        # Calculate fibonacci retracements based on market order price and duration defined in config.json.
-        highest_price = current_data['high'].tail(config["Fibonacci_duration"]).max()
-        lowest_price = current_data['low'].tail(config["Fibonacci_duration"]).min()
-    
-        delta_diff = highest_price - lowest_price
-        
-        retracements = {
-            1: [(fill_price+delta_diff*0.236).round(4),(fill_price-delta_diff*0.236).round(4)],
-            2: [(fill_price+delta_diff*0.382).round(4),(fill_price-delta_diff*0.382).round(4)],
-            3: [(fill_price+delta_diff*0.5).round(4),(fill_price-delta_diff*0.5).round(4)],
-            4: [(fill_price+delta_diff*0.618).round(4),(fill_price-delta_diff*0.618).round(4)],
-            5: [(fill_price+delta_diff*0.786).round(4),(fill_price-delta_diff*0.786).round(4)]
-        }
-        
-        print_strings("Fibonacci retracements calculated!")
-        return retracements
-
-    def execute_trade(order_type, config, price):
-        # Simulate execution of market order and return order's info with position(dict).
-        size = config["Initial_size_trade"]
-        position_value = size * price
-        position = {"type": order_type, "size": size, "price": price, "value": position_value, "order_type":"market"}
-        print_strings(f"Executed {order_type} trade at price {price}")
-        return position
-    
-    def tp_order(position, config):
-        # Function for define a take profit order and return order's info with tp_postion(dict).
-        # The type of order is opposite to the market order one's. 
-        if position["type"] == "BUY": 
-            type_order = "SELL"
+class Ladder:
+    # Open Martingale ladder of the backtest: the market entry, its fibonacci limit orders and the
+    # take profit of every ladder depth. Levels are stored in preallocated arrays and filled in order
+    # through a cursor, so filling a level and moving the take profit are O(1) and allocate nothing.
+    # One instance is reused for every ladder of a backtest.
+    __slots__ = ("side", "tp_side", "prices", "sizes", "tp_prices", "tp_sizes", "depth", "cursor", "tp_price", "tp_size", "is_open")
+
+    def __init__(self, max_depth):
+        self.prices = np.zeros(max_depth) # Fibonacci limit prices, nearest to the entry first.
+        self.sizes = np.zeros(max_depth)
+        self.tp_prices = np.zeros(max_depth) # Take profit once the level at the same index is filled.
+        self.tp_sizes = np.zeros(max_depth)
+        self.depth = 0
+        self.cursor = 0 # Next level to fill.
+        self.side = None
+        self.tp_side = None
+        self.tp_price = 0.0
+        self.tp_size = 0.0
+        self.is_open = False
+
+    def open(self, side, price, template, config):
+        # Place the fibonacci orders and the take profit of a market order filled at price,
+        # shifting the ladder template (see fibonacci.py) by the fill price.
+        self.side = side
+        self.tp_side = "SELL" if side == "BUY" else "BUY"
+        self.depth = config["Martingale_max"]
+        self.cursor = 0
+        self.is_open = True
+
+        # The take profit of each depth is based on the average price of the filled orders.
+        self.prices[:self.depth], self.tp_prices[:self.depth] = ladder_prices(template, price)
+        self.sizes[:self.depth] = template["sizes"]
+        self.tp_sizes[:self.depth] = template["tp_sizes"]
+        for level in range(self.depth):
+            backtest_log.info("Placing fibonacci order. Type: %s, Price: %s", side, self.prices[level])
+
+        # Take profit of the market order alone.
+        if side == "BUY":
+            self.tp_price = round((config["Take_profit"]+1)*price,4)
         else:
-            type_order = "BUY"
-        
-        # Calculate the take profit order's price based on the defined percentage in config.json.
-        if type_order == "BUY":
-            price_limit = round((1-config["Take_profit"])*position["price"],4)
+            self.tp_price = round((1-config["Take_profit"])*price,4)
+        self.tp_size = template["size"]
+        backtest_log.info("Placing take profit order. Type: %s, Size: %s", self.tp_side, self.tp_size)
+
+    def next_price(self):
+        # Price of the next fibonacci order, None once they are all filled.
+        return self.prices[self.cursor] if self.cursor < self.depth else None
+
+    def fill_level(self):
+        # Fill the next fibonacci order and move the take profit to its cumulative size.
+        self.tp_price = self.tp_prices[self.cursor]
+        self.tp_size = self.tp_sizes[self.cursor]
+        self.cursor += 1
+
+    def close(self):
+        self.is_open = False
+
+    def levels(self):
+        # Prices at which the open orders start filling: BUY orders fill at or below buy_level, 
+        # SELL orders at or above sell_level.
+        next_price = self.next_price()
+        buy_level, sell_level = -np.inf, np.inf
+        if self.side == "BUY":
+            sell_level = self.tp_price
+            if next_price is not None:
+                buy_level = next_price
         else:
-            price_limit = round((config["Take_profit"]+1)*position["price"],4)
-
-        tp_position = {"type": type_order, "size": position['size'], "price": price_limit, "value": price_limit* position['size'],  "order_type":"tp_order"}
-        print_strings(f"Placing take profit order. Type: {tp_position['type']}, Size: {tp_position['size']}")
-        return tp_position
-
-    def fibonacci_order(position, config, retracements):
-        # Function for define fibonacci orders and their respective take profit orders.
-        # Return the dictionary of sizes and take-profit prices, and the list of limit trades
-
-        sizes_tp = {} # Dictionary to store cumulative trade sizes and their corresponding take-profit prices.
-        cumulative_size = config["Initial_size_trade"] 
-        total_value = config["Initial_size_trade"] * position["price"]
-
-        fibo_trades = []
-        # Start loop based on the given Martingale_max in config.json.
-        for i in range(1,config["Martingale_max"]+1): 
-            if position["type"] == "BUY":
-                price_limit = retracements[i][1]
-            if position["type"] == "SELL": 
-                price_limit = retracements[i][0]
-            size = round(position['size']*config["Martingale_multiplier"]**i,4)
-            fibo_position =  {"type": position["type"], "size": size, "price": price_limit, "value": price_limit*size,  "order_type":"fibo_order"}
-            fibo_trades.append(fibo_position)
-            print_strings(f"Placing fibonacci order. Type: {fibo_position['type']}, Price: {price_limit}")
-
-            # Update cumulative size and total value after placing the new limit order.
-            cumulative_size += size
-            total_value += size * price_limit
-            # Calculate the new average price after placing the limit order.
-            average_price = total_value / cumulative_size
-
-
-            # Store the cumulative size and corresponding take-profit price in sizes_tp.
-            # Determine the take-profit price based on the average price and the order type.
-            if position["type"] == "BUY":
-                tp_price = average_price * (1 + config["Take_profit"])
-                tp_type = "SELL"
-                sizes_tp[i] = {'size': round(cumulative_size,4), 'price': round(tp_price,4), 'type': tp_type}
-            else:  
-                tp_price = average_price * (1 - config["Take_profit"])
-                tp_type = "BUY"
-                sizes_tp[i] = {'size': round(cumulative_size,4), 'price': round(tp_price,4), 'type': tp_type}
-        
-        return sizes_tp, fibo_trades
+            buy_level = self.tp_price
+            if next_price is not None:
+                sell_level = next_price
+        return buy_level, sell_level
+
+def crossed(side, price, low, high):
+    # A BUY limit order fills once the price trades at or below it, a SELL one at or above it.
+    return price >= low if side == "BUY" else price <= high
+
+def backtest_strategy(config, historical_data, vectorized=False, start=0, end=None, signals=None, close_at_end=False):
+    # Run the strategy over historical_data. With vectorized=True indicators and signals are
+    # precomputed over the full dataset and bars without signal or open ladder are skipped.
+    # Trading can be restricted to the bars [start, end), indicators still use the bars before start.
+    # signals (from compute_signals on the same data and config) can be passed to reuse them between runs.
+    # Like the live monitor, trading stops once the equity falls below Max_drawdown of the initial cash:
+    # the open orders are cancelled and the position is closed at market (STOP_* in the trade log).
+    # With close_at_end, a ladder still open at the last bar is closed at its close (CLOSE_* in the trade log),
+    # so the runs of consecutive windows can be stitched together (walk_forward.py).
+    # Return historical_data and the TradeLog of the trades (see trade_log.py).
+    
+    def trade(side, size, price):
+        # Cash paid (or received) for a fill.
+        nonlocal cash
+        cash -= size * price if side == "BUY" else -size * price
+
+    def stop_price():
+        # Price at which the equity of the open ladder (cash + position at that price) falls to the stop level.
+        position = ladder.tp_size if ladder.side == "BUY" else -ladder.tp_size
+        return (stop_equity - cash) / position
+
+    def open_position(i, order_type):
+        # Execute the market order at the close of bar i, then place the fibonacci 
+        # (martingale) limit orders and the take profit. 
+        backtest_log.info("Executed %s trade at price %s", order_type, closes[i])
+        trade(order_type, config["Initial_size_trade"], closes[i])
+
+        trade_log.append(f"MKT_{order_type}", i, closes[i], config["Initial_size_trade"], 0)
+
+        # Order based on Fibonacci (place a series of limit orders based on the martingale strategy).
+        template = ladder_template(bar_highs[:i+1], bar_lows[:i+1], order_type, config)
+        ladder.open(order_type, closes[i], template, config)
+
+    def check_limit_orders(i):
+        # Check if the open limit orders are filled.
+        # For backtest purpose we assume a limit order is filled once the correct price is reached. 
+        # With Intrabar_fills the bar low/high are checked instead of the close and orders fill at their price.
+        low = lows[i]
+        high = highs[i]
+
+        # Fill the crossed fibonacci orders in ladder order, each one moves the take profit.
+        while ladder.next_price() is not None and crossed(ladder.side, ladder.next_price(), low, high):
+            price = ladder.next_price() if intrabar else closes[i]
+            ladder.fill_level()
+            trade(ladder.side, ladder.sizes[ladder.cursor-1], price)
+            backtest_log.info("Fibo orders filled, take profit moved to %s", ladder.tp_price)
+            trade_log.append(f"FIBO_{ladder.side}", i, price, ladder.sizes[ladder.cursor-1], ladder.cursor)
+
+        # Check the drawdown at the worst price of the bar, before the take profit.
+        stop = stop_price()
+        if crossed(ladder.side, stop, low, high):
+            stop_out(i, stop)
+            return
+
+        # Check if the take profit is filled.
+        if crossed(ladder.tp_side, ladder.tp_price, low, high):
+            backtest_log.info("TP orders filled %s", ladder.tp_price)
+            price = ladder.tp_price if intrabar else closes[i]
+            trade(ladder.tp_side, ladder.tp_size, price)
+            trade_log.append(f"TP_{ladder.tp_side}", i, price, ladder.tp_size, ladder.cursor)
+            ladder.close()
+
+    def stop_out(i, stop):
+        # Max drawdown reached: cancel the open orders and close the position at market, at the
+        # stop price with Intrabar_fills (or the open if the bar gapped through it), at the close otherwise.
+        nonlocal stopped
+        if intrabar:
+            price = min(stop, opens[i]) if ladder.side == "BUY" else max(stop, opens[i])
+        else:
+            price = closes[i]
+        trade(ladder.tp_side, ladder.tp_size, price)
+        backtest_log.info("Max drawdown reached at step %s, position closed at %s", i, price)
+        trade_log.append(f"STOP_{ladder.tp_side}", i, price, ladder.tp_size, ladder.cursor)
+        ladder.close()
+        stopped = True
+
+    def close_position(i):
+        # End of the run: cancel the open orders and close the position at the close of bar i.
+        trade(ladder.tp_side, ladder.tp_size, closes[i])
+        backtest_log.info("Ladder still open at step %s, position closed at %s", i, closes[i])
+        trade_log.append(f"CLOSE_{ladder.tp_side}", i, closes[i], ladder.tp_size, ladder.cursor)
+        ladder.close()
 
 
     # Define initial variables.
-    filled_orders = {} # Contains all filled orders (market, fibonacci, take profit).
-    limit_orders = {} # Contains existing limit orders (fibonacci, take profit).
-    trade_history = [] # Contains time series for plotting purposes. 
-    cash = 100000 # Initial cash. 
-    minimum_indicators_to_open = config["minimum_indicators_to_open"] # The minimum indicators that should be met in order to open a position.
-    
+    ladder = Ladder(config["Martingale_max"]) # Open ladder (fibonacci and take profit orders).
+    # Trades of the backtest: bar, type, price, size and ladder level, dated with the bars when they have a date.
+    trade_log = TradeLog(historical_data['date'].to_numpy() if 'date' in historical_data else None)
+    cash = INITIAL_CASH # Cash of the account, the equity is cash + open position at the current price.
+    stop_equity = INITIAL_CASH * (1 - config["Max_drawdown"]) # Trading stops below this equity.
+    stopped = False
+    closes = historical_data['close'].to_numpy()
+    opens = historical_data['open'].to_numpy()
+    bar_highs = historical_data['high'].to_numpy() # Fibonacci range of the ladders
+    bar_lows = historical_data['low'].to_numpy()
+    # Prices checked against the limit orders: bar low/high with Intrabar_fills, the close otherwise.
+    intrabar = config.get("Intrabar_fills", "False").lower() == "true"
+    lows = bar_lows if intrabar else closes
+    highs = bar_highs if intrabar else closes
+
     # Filter to ensure the loop starts only after the longest required time duration 
     # from the indicator settings has been reached. The loop will only begin once 
     # the maximum duration (across SMA, RSI, and Bollinger Bands) is satisfied, 
     # ensuring all indicators have enough data to generate valid signals.
     filter = max(config["SMA_big_duration"],  config["RSI_duration"], config["bolinger_band_duration"], config["bolinger_band_std_dev"], config["RSI_high"], config["RSI_low"]) 
+    first = max(filter, start)
+    end = len(historical_data) if end is None else min(end, len(historical_data))
+
+    if vectorized:
+        # Compute every indicator once over the full dataset and turn them into signal arrays. 
+        # The loop below only visits bars where a signal fires or where a ladder is open.
+        if signals is None:
+            signals = compute_signals(historical_data, config)
+        indicators_sum = signals["sum"]
+        signal_steps = np.flatnonzero(signals["open"])
+
+        i = first
+        while i < end:
+            if not ladder.is_open:
+                # Jump straight to the next bar with a signal.
+                next_signal = np.searchsorted(signal_steps, i)
+                if next_signal == len(signal_steps) or signal_steps[next_signal] >= end:
+                    break
+                i = int(signal_steps[next_signal])
+                open_position(i, get_order_type(indicators_sum[i], config))
+            else:
+                # Jump straight to the next bar crossing one of the open order prices or
+                # the drawdown stop, the bars in between can not fill anything.
+                buy_level, sell_level = ladder.levels()
+                if ladder.side == "BUY":
+                    buy_level = max(buy_level, stop_price())
+                else:
+                    sell_level = min(sell_level, stop_price())
+                i = find_next_cross(lows[:end], highs[:end], i, buy_level, sell_level)
+                if i == end:
+                    break
+                check_limit_orders(i)
+                if stopped:
+                    break
+            i += 1
+
+        if close_at_end and ladder.is_open:
+            close_position(end - 1)
+        log_summary(trade_log, closes, config, start=first, end=end)
+        return historical_data, trade_log
+
+    # Indicators are updated incrementally with one close per bar (O(1) per bar) 
+    # instead of being recomputed with ta over the whole prefix at every step.
+    # Warm up the stream with the bars preceding the first tradable one.
+    indicators = IndicatorStream(config)
+    for close in closes[:first]:
+        indicators.update(close)
     
     # Starts iteration over each row of historical data. 
-    for i in range(filter, len(historical_data)):
-        # Extract data up to the current point and calculate indicators
-        current_data = historical_data.iloc[:i+1]
+    for i in range(first, end):
+        # Update indicators with the new close.
+        indicators.update(closes[i])
        
         # Continue with market order execution only if no limit orders exist. 
-        if len(limit_orders) == 0:
-
-            # Calculate indicators.
-            sma_small, sma_big, rsi, bollinger_h, bollinger_l = calculate_indicators(current_data)
+        if not ladder.is_open:
 
             # Detect signal values.
-            cross_value = detect_cross(sma_small, sma_big)
-            rsi_value = detect_RSI(rsi, config)
-            bollinger_value = detect_bollinger(current_data, bollinger_h, bollinger_l)
-
-            # Check if trade conditions are met.
-            indicators_sum = cross_value + rsi_value + bollinger_value
-
-            if indicators_sum >= minimum_indicators_to_open:
-                # Execute markert order.
-                order_type = "BUY" if config["Trending"].lower() == "true" else "SELL" # Define the type of order based on Trending variable in config.json.
-                position = execute_trade(order_type, config, current_data.iloc[-1]['close'])
-
-                # Append to trade_history(list) for plotting purposes. 
-                trade_history.append({"position": f"MKT_{order_type}", "type": "BUY", "price": current_data.iloc[-1]['close'], "step": i})
-
-                # Dict management. 
-                key = len(filled_orders) # Use actual length of the dict as key.
-                filled_orders[key] = position # Add the new position.
-
-                # Order based on Fibonacci (place a series of limit orders based on the martingale strategy).
-                retracements  = get_fibonacci_levels(current_data, config, fill_price=current_data.iloc[-1]['close'])
-                sizes_tp, fibo_trades = fibonacci_order(position, config, retracements)
-
-                # Take Profit. 
-                tp_position = tp_order(position, config)
-
-                # Update respective dictionary with the new limit orders. 
-                limit_orders["fibo_orders"] = fibo_trades
-                limit_orders["tp_orders"] = tp_position
-        
-            # The process is specular from the previous one. 
-            elif indicators_sum <= -minimum_indicators_to_open:
-                # Execute markert order.
-                order_type = "SELL" if config["Trending"].lower() == "true"  else "BUY"
-                position = execute_trade(order_type, config, current_data.iloc[-1]['close'])
-                
-                # Dict management. 
-                key = len(filled_orders)
-                filled_orders[key] = position
-
-                # Append to trade_history(list) for plotting purposes. 
-                trade_history.append({"position": f"MKT_{order_type}", "type": "BUY", "price": current_data.iloc[-1]['close'], "step": i})
-
-                # Order based on Fibonacci (place a series of limit orders based on the martingale strategy).
-                retracements  = get_fibonacci_levels(current_data, config, fill_price=current_data.iloc[-1]['close'])
-                sizes_tp, fibo_trades = fibonacci_order(position, config, retracements)
-
-                # Take Profit.
-                tp_position = tp_order(position, config)
-
-                # Update respective dictionary with the new limit orders. 
-                limit_orders["fibo_orders"] = fibo_trades
-                limit_orders["tp_orders"] = tp_position
-
-
-        # Check if limit ordes stored in their respective dictionaries are filled
-        # For backtest purpose we assume a limit order is filled once the correct price is reached. 
-        else: 
+            cross_value = detect_cross(indicators.prev_sma_small, indicators.sma_small, indicators.prev_sma_big, indicators.sma_big)
+            rsi_value = detect_RSI(indicators.rsi, config)
+            bollinger_value = detect_bollinger(indicators.close, indicators.bollinger_h, indicators.bollinger_l)
 
-            # Iterate over fibonacci orders dict.
-            for fibo_trades in limit_orders["fibo_orders"]:   
-                
-                # Check if a BUY order is filled.
-                if fibo_trades["type"] == "BUY":
-                    if fibo_trades["price"] >= current_data.iloc[i]["close"]: 
-                        # Remove the order from the dict once is filled.
-                        limit_orders["fibo_orders"].remove(fibo_trades) 
-                        print_strings(f"Fibo orders filled")
-
-                        # print(current_data.iloc[-1]['close'])
-                        # print(fibo_trades["price"])
-                        # print_index(i, "FIBO ORDER FILLED")
-
-                        # Reset tp_orders and add the new take profit based on the fibonacci one. 
-                        limit_orders["tp_orders"] = 0  
-                        limit_orders["tp_orders"] = list(sizes_tp.items())[0][1]
-                        # print(limit_orders["tp_orders"])
-
-                        # Modify the take profit (of fibo orders) dict adequately. 
-                        first_key = next(iter(sizes_tp))
-                        sizes_tp.pop(first_key)
-                        print_strings(f"Take profit of the following fibo order is executed")
-
-                        # Append to trade_history(list) for plotting purposes. 
-                        trade_history.append({"position": "FIBO_BUY", "type": "BUY", "price": current_data.iloc[-1]['close'], "step": i})
-                        
-                # Check if a SELL order is filled (specular from the previous one)
-                if fibo_trades["type"] == "SELL":
-                    if fibo_trades["price"] <= current_data.iloc[i]["close"]: 
-                        # Remove the order from the dict once is filled.
-                        limit_orders["fibo_orders"].remove(fibo_trades)
-                        print_strings(f"Fibo orders filled")
-
-                        # print_index(i, "FIBO ORDER FILLED")
-                        # print(current_data.iloc[-1]['close'])
-                        # print(fibo_trades["price"])
-
-                        # Reset tp_orders and add the new take profit based on the fibonacci one. 
-                        limit_orders["tp_orders"] = 0 
-                        limit_orders["tp_orders"] = list(sizes_tp.items())[0][1]
-                        # print(limit_orders["tp_orders"])
-
-                        # Modify the take profit (of fibo orders) dict adequately. 
-                        first_key = next(iter(sizes_tp))
-                        sizes_tp.pop(first_key)
-                        print_strings(f"Take profit the following fibo order is executed ")
-
-                        # Append to trade_history(list) for plotting purposes. 
-                        trade_history.append({"position": "FIBO_SELL", "type": "SELL", "price": current_data.iloc[-1]['close'], "step": i})
-                        
-
-            # Check if BUY tp_orders are filled. 
-            if limit_orders["tp_orders"]["type"] == "BUY":
-                if limit_orders["tp_orders"]["price"] >= current_data.iloc[i]["close"]:
-                    print_strings(f"TP orders filled {str(limit_orders['tp_orders']['price'])}")
-                    # print_index(i, "TP ORDER FILLED")
-                    # print(current_data.iloc[-1]['close'])
-                    # print(limit_orders["tp_orders"]["price"])
-
-                    # Append to trade_history(list) for plotting purposes. 
-                    trade_history.append({"position": "TP_BUY", "type": "BUY", "price": current_data.iloc[-1]['close'], "step": i})
-                    
-                    #Reset the dict 
-                    limit_orders = {}
-
-            # Check if SELL tp_orders are filled (specular to the previous one).
-            else:
-                if limit_orders["tp_orders"]["price"] <= current_data.iloc[i]["close"]: 
-                    print_strings(f"TP orders filled {str(limit_orders['tp_orders']['price'])}")
-                    # print_index(i, "TP ORDER FILLED")
-                    # print(current_data.iloc[-1]['close'])
-                    # print(fibo_trades["price"])
-
-                    # Append to trade_history(list) for plotting purposes. 
-                    trade_history.append({"position": "TP_SELL", "type": "BUY", "price": current_data.iloc[-1]['close'], "step": i})
-                    
-                    #Reset the dict 
-                    limit_orders = {}
-    
-    # Return entire dataset and trade_history list for plotting purposes. 
-    return historical_data, trade_history
+            # Check if trade conditions are met, the type of order is based on Trending variable in config.json.
+            order_type = get_order_type(cross_value + rsi_value + bollinger_value, config)
+            if order_type is not None:
+                open_position(i, order_type)
+
+        else: 
+            check_limit_orders(i)
+            if stopped:
+                break
+
+    if close_at_end and ladder.is_open:
+        close_position(end - 1)
+    log_summary(trade_log, closes, config, start=first, end=end)
+    return historical_data, trade_log
+
+def find_next_cross(lows, highs, start, buy_level, sell_level, chunk=1024):
+    # First bar from start where the low reaches buy_level or the high reaches sell_level, 
+    # len(lows) if there is none. The arrays are scanned in growing chunks, so a ladder
+    # filled a few bars later does not pay for a scan of the whole dataset.
+    n = len(lows)
+    while start < n:
+        end = min(start + chunk, n)
+        hits = np.flatnonzero((lows[start:end] <= buy_level) | (highs[start:end] >= sell_level))
+        if len(hits):
+            return start + int(hits[0])
+        start = end
+        chunk *= 2
+    return n
+
+def log_summary(trade_log, closes=None, config=None, start=0, end=None):
+    # One line summary of a backtest run, the only output of a backtest in quiet mode.
+    # With the closes and config, the PnL of the bars [start, end) is added (see accounting.py).
+    if not log.isEnabledFor(logging.INFO):
+        return
+    log.info("Backtest completed: %s entries, %s fibonacci orders filled, %s take profits filled, %s drawdown stop-outs, %s closed at the end",
+             trade_log.count("MKT"), trade_log.count("FIBO"), trade_log.count("TP"), trade_log.count("STOP"), trade_log.count("CLOSE"))
+    if closes is not None:
+        stats = backtest_statistics(closes, trade_log, parse_bar_size(config["barSizeSetting"]), start=start, end=end)
+        log.info("PnL: %.2f, max drawdown: %.2f%%, Sharpe: %.2f, win rate: %.2f, time in market: %.2f",
+                 stats["total_pnl"], stats["max_drawdown"]*100, stats["sharpe"], stats["win_rate"], stats["time_in_market"])
+
+def main(argv=None):
+    # Command line entry point. Return the process exit code.
+    parser = argparse.ArgumentParser(description="Backtest of the trading bot strategy.")
+    parser.add_argument("--config", default="config.json", help="configuration file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a configuration setting")
+    parser.add_argument("--daemon", action="store_true", help="no banner and no prompts")
+    parser.add_argument("--host", help="IB Gateway host (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="IB Gateway port (default 7497)")
+    parser.add_argument("--client-id", type=int, help="IB client id (default 1)")
+    args = parser.parse_args(argv)
+
+    if not args.daemon:
+        welcome() # Launch the initial logging.
+    config = get_config(args.config, settings.parse_overrides(args.set)) # Read configuration parameters from config.json.
+    if config is None:
+        return 1
+    logger.configure(config.get("Log_level"), quiet=config.get("Backtest_quiet", "False").lower() == "true")
+    myAccount, ib = boot_IB(args.host, args.port, args.client_id) # Get IB gateaway established. 
+    if ib is None:
+        return 1
+    contract = get_contract(config) # Get the requested pair contract.
+    if contract is None:
+        return 1
+    historical_data = get_data(config, ib, contract) # Get historical data from IB gateaway.
+    ib.disconnect()
+    if historical_data is None:
+        return 1
+    historical_data, trade_log = backtest_strategy(config, historical_data, vectorized=True) # Get historical data and the trades.
+    if config.get("Trades_file"):
+        print_strings("Trades written to " + trade_log.export(config["Trades_file"])) # Save the trades.
+    if config.get("Plot_file"):
+        print_strings("Plot written to " + plot_trades(historical_data, trade_log, config["Plot_file"])) # Plot the results.
+    return 0
 
 
 # The main script execution.
-welcome() # Launch the initial logging.
-myAccount, ib = boot_IB() # Get IB gateaway established. 
-if ib is not None:
-    config = get_config() # Read configuration parameters from config.json.
-    if config is not None:
-        contract = get_contract(config) # Get the requested pair contract.
-        if contract is not None:
-            historical_data = get_data(config, ib, contract) # Get historical data from IB gateaway.
-            historical_data, trade_history = backtest_strategy(config, historical_data) # Get historical data and list of trades for plotting purposes. 
-            
-            # Plot the results. 
-            
-            # Initialize lists to store steps and prices for each trade type
-            mkt_buy_steps = []
-            mkt_buy_prices = []
-            mkt_sell_steps = []
-            mkt_sell_prices = []
-            tp_buy_steps = []
-            tp_buy_prices = []
-            tp_sell_steps = []
-            tp_sell_prices = []
-            fibo_buy_steps = []
-            fibo_buy_prices = []
-            fibo_sell_steps = []
-            fibo_sell_prices = []
-
-            # Collect all trades into respective lists
-            for trade in trade_history:
-                if trade['position'] == 'MKT_BUY':
-                    mkt_buy_steps.append(trade['step'])
-                    mkt_buy_prices.append(trade['price'])
-                elif trade['position'] == 'MKT_SELL':
-                    mkt_sell_steps.append(trade['step'])
-                    mkt_sell_prices.append(trade['price'])
-                elif trade['position'] == 'TP_BUY':
-                    tp_buy_steps.append(trade['step'])
-                    tp_buy_prices.append(trade['price'])
-                elif trade['position'] == 'TP_SELL':
-                    tp_sell_steps.append(trade['step'])
-                    tp_sell_prices.append(trade['price'])
-                elif trade['position'] == 'FIBO_BUY':
-                    fibo_buy_steps.append(trade['step'])
-                    fibo_buy_prices.append(trade['price'])
-                elif trade['position'] == 'FIBO_SELL':
-                    fibo_sell_steps.append(trade['step'])
-                    fibo_sell_prices.append(trade['price'])
-
-            # Create the figure
-            fig = go.Figure()
-
-            # Add the price line (the historical price series)
-            fig.add_trace(go.Scatter(
-                y=historical_data['close'], 
-                mode='lines', 
-                name='Price',
-                line=dict(color='blue', width=2),
-                hoverinfo='y'
-            ))
-
-            # Add all trades in single traces for each type
-            if mkt_buy_steps:
-                fig.add_trace(go.Scatter(
-                    x=mkt_buy_steps, 
-                    y=mkt_buy_prices, 
-                    mode='markers', 
-                    marker=dict(color='lime', symbol='triangle-up', size=12, line=dict(width=2, color='black')), 
-                    name='MKT_BUY', 
-                    hoverinfo='x+y'
-                ))
-
-            if mkt_sell_steps:
-                fig.add_trace(go.Scatter(
-                    x=mkt_sell_steps, 
-                    y=mkt_sell_prices, 
-                    mode='markers', 
-                    marker=dict(color='firebrick', symbol='triangle-down', size=12, line=dict(width=2, color='black')), 
-                    name='MKT_SELL', 
-                    hoverinfo='x+y'
-                ))
-
-            if tp_buy_steps:
-                fig.add_trace(go.Scatter(
-                    x=tp_buy_steps, 
-                    y=tp_buy_prices, 
-                    mode='markers', 
-                    marker=dict(color='orange', symbol='circle', size=10, line=dict(width=2, color='black')), 
-                    name='TP_BUY', 
-                    hoverinfo='x+y'
-                ))
-
-            if tp_sell_steps:
-                fig.add_trace(go.Scatter(
-                    x=tp_sell_steps, 
-                    y=tp_sell_prices, 
-                    mode='markers', 
-                    marker=dict(color='darkorange', symbol='x', size=10, line=dict(width=2, color='black')), 
-                    name='TP_SELL', 
-                    hoverinfo='x+y'
-                ))
-
-            if fibo_buy_steps:
-                fig.add_trace(go.Scatter(
-                    x=fibo_buy_steps, 
-                    y=fibo_buy_prices, 
-                    mode='markers', 
-                    marker=dict(color='deepskyblue', symbol='diamond', size=12, line=dict(width=2, color='black')), 
-                    name='FIBO_BUY', 
-                    hoverinfo='x+y'
-                ))
-
-            if fibo_sell_steps:
-                fig.add_trace(go.Scatter(
-                    x=fibo_sell_steps, 
-                    y=fibo_sell_prices, 
-                    mode='markers', 
-                    marker=dict(color='darkred', symbol='diamond', size=12, line=dict(width=2, color='black')), 
-                    name='FIBO_SELL', 
-                    hoverinfo='x+y'
-                ))
-
-            # Update layout with better titles, axis labels, and improved legend
-            fig.update_layout(
-                title='Price Series with Buy/Sell Points',
-                xaxis_title='Time (Steps)',
-                yaxis_title='Price',
-                legend_title='Trade Type',
-                template='plotly_white',
-                hovermode='x unified',
-                margin=dict(l=40, r=40, t=40, b=40),
-            )
-
-            # Show the plot
-            fig.show()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
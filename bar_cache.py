@@ -0,0 +1,178 @@
+import os
+import math
+import time
+import numpy as np
+from metrics import span
+
+# Local store of historical bars, one file per (pair, barSizeSetting, whatToShow).
+# Files are flat arrays of fixed-size records: new bars are appended at the end and
+# the whole file is read back as a memory map, so nothing is parsed on load.
+# Next to every cache file, <cache file>.start holds the start of the period the downloads covered.
+# pandas is only imported when the bars are converted, after the first request to IB.
+CACHE_DIR = "bar_cache"
+
+BAR_DTYPE = np.dtype([
+    ("date", "<i8"), # Bar start, seconds since epoch (UTC).
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+    ("average", "<f8"),
+    ("barCount", "<i8"),
+])
+
+# Seconds per unit of IB barSizeSetting ("10 mins") and durationStr ("1 D").
+BAR_SIZE_UNITS = {"sec": 1, "min": 60, "hour": 3600, "day": 86400, "week": 604800, "month": 2592000}
+DURATION_UNITS = {"S": 1, "D": 86400, "W": 604800, "M": 2592000, "Y": 31536000}
+
+
+def parse_bar_size(barSizeSetting):
+    # Convert an IB barSizeSetting ("1 min", "10 mins", "1 hour", "1 day"...) into seconds.
+    value, unit = barSizeSetting.split()
+    return int(value) * BAR_SIZE_UNITS[unit.lower().rstrip("s")]
+
+def parse_duration(durationStr):
+    # Convert an IB durationStr ("3600 S", "1 D", "3 M"...) into seconds.
+    value, unit = durationStr.split()
+    return int(value) * DURATION_UNITS[unit.upper()]
+
+def to_duration(seconds):
+    # Smallest IB durationStr covering the given number of seconds.
+    # IB only accepts durations in seconds up to one day.
+    if seconds <= 86400:
+        return f"{max(int(math.ceil(seconds)), 60)} S"
+    return f"{int(math.ceil(seconds / 86400))} D"
+
+def cache_path(pair, barSizeSetting, whatToShow, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{pair}_{barSizeSetting.replace(' ', '')}_{whatToShow}.bars")
+
+def load_bars(path):
+    # Memory map the cached bars (read only), empty array if nothing is cached yet.
+    # A partial record at the end (file cut by a crash or a full disk) is ignored.
+    count = os.path.getsize(path) // BAR_DTYPE.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+    return np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(count,))
+
+def store_bars(path, records):
+    # Append records to the cache. Cached bars starting at or after the first new bar are
+    # overwritten, so the last (still forming) bar of the previous download gets replaced.
+    # The cache is written next to it and renamed over it, so an interruption leaves the previous cache untouched.
+    if len(records) == 0:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cached = load_bars(path)
+    keep = np.searchsorted(cached["date"], records["date"][0], side="left")
+    with open(path + ".tmp", "wb") as f:
+        f.write(cached[:keep].tobytes())
+        f.write(records.tobytes())
+    del cached # Release the memory map before replacing the file.
+    os.replace(path + ".tmp", path)
+
+def covered_since(path):
+    # Start of the period covered by the cache (epoch seconds), None if nothing is cached. The first
+    # cached bar can be later than that (no bars over a weekend), it is only used for older caches.
+    try:
+        with open(path + ".start") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        cached = load_bars(path)
+        return int(cached["date"][0]) if len(cached) else None
+
+def set_covered_since(path, start):
+    with open(path + ".start.tmp", "w") as f:
+        f.write(str(int(start)))
+    os.replace(path + ".start.tmp", path + ".start")
+
+def merge_bars(path, records):
+    # Merge records anywhere into the cache (e.g. older bars from a backfill), sorted by date
+    # without duplicates: for bars with the same date, the last one of records wins over the cache.
+    # The merged file is written next to the cache and renamed over it, so an interruption
+    # leaves the previous cache untouched.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    merged = np.concatenate((np.array(load_bars(path)), records))
+    merged = merged[np.argsort(merged["date"], kind="stable")]
+    last = np.ones(len(merged), dtype=bool) # Last bar of every date
+    last[:-1] = merged["date"][1:] != merged["date"][:-1]
+    merged = merged[last]
+    merged.tofile(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return len(merged)
+
+def bars_to_records(bars):
+    # Convert ib_insync BarData objects into cache records.
+    import pandas as pd
+    records = np.empty(len(bars), dtype=BAR_DTYPE)
+    for i, bar in enumerate(bars):
+        records[i] = (pd.Timestamp(bar.date).timestamp(), bar.open, bar.high, bar.low,
+                      bar.close, bar.volume, bar.average, bar.barCount)
+    return records
+
+def records_to_df(records):
+    # Same columns as util.df(bars), with UTC dates.
+    import pandas as pd
+    myData = pd.DataFrame({name: np.asarray(records[name]) for name in BAR_DTYPE.names})
+    myData["date"] = pd.to_datetime(myData["date"], unit="s", utc=True)
+    return myData
+
+def get_bars(ib, contract, config, whatToShow='MIDPOINT', cache_dir=None):
+    # Return the durationStr window of bars for the contract as a DataFrame.
+    # Only bars from the last cached one onwards are requested to IB, the rest is served from disk.
+    # With Base_barSizeSetting, bars of that size are downloaded and resampled to barSizeSetting.
+    base = config.get("Base_barSizeSetting")
+    if base and base != config["barSizeSetting"]:
+        return get_timeframes(ib, contract, config, [config["barSizeSetting"]], whatToShow, cache_dir)[config["barSizeSetting"]]
+
+    path = cache_path(config["pair"], config["barSizeSetting"], whatToShow, cache_dir or CACHE_DIR)
+    window = parse_duration(config["durationStr"])
+    now = time.time()
+
+    cached = load_bars(path)
+    since = covered_since(path)
+    # Download the whole window when nothing usable is cached, or when the cache starts inside the
+    # window (durationStr raised, cache built with a shorter window): the head would be missing.
+    full_window = len(cached) == 0 or now - cached["date"][-1] >= window or since > now - window
+    if full_window:
+        durationStr = config["durationStr"]
+    else:
+        # Download from the start of the last cached bar, which might have been incomplete.
+        durationStr = to_duration(now - cached["date"][-1] + parse_bar_size(config["barSizeSetting"]))
+    del cached
+
+    with span("historical_download", pair=config["pair"]):
+        bars = ib.reqHistoricalData(
+            contract, endDateTime='', durationStr=durationStr,
+            barSizeSetting=config["barSizeSetting"], whatToShow=whatToShow, useRTH=0, formatDate=2)
+
+    # Conversion of the received bars into the DataFrame (what util.df used to do), cache included.
+    with span("bars_to_df", pair=config["pair"]):
+        store_bars(path, bars_to_records(bars))
+        if full_window and len(bars):
+            set_covered_since(path, now - window)
+
+        # The window ends with the last bar received (the current one), rather than the local clock.
+        cached = load_bars(path)
+        if len(cached) == 0:
+            return records_to_df(cached)
+        end = cached["date"][-1] + parse_bar_size(config["barSizeSetting"])
+        start = np.searchsorted(cached["date"], end - window, side="left")
+        return records_to_df(cached[start:])
+
+def get_timeframes(ib, contract, config, bar_sizes, whatToShow='MIDPOINT', cache_dir=None):
+    # Download the Base_barSizeSetting bars (barSizeSetting if not set) once and resample them
+    # into every bar size of bar_sizes ("10 mins", "1 hour"...). Return a dict bar size -> DataFrame.
+    from resample import resample
+    base = config.get("Base_barSizeSetting") or config["barSizeSetting"]
+    base_data = get_bars(ib, contract, dict(config, barSizeSetting=base, Base_barSizeSetting=""), whatToShow, cache_dir)
+    frames = {}
+    for bar_size in bar_sizes:
+        if bar_size == base:
+            frames[bar_size] = base_data
+            continue
+        frame = resample(base_data, parse_bar_size(bar_size))
+        # Drop the first bar if the window starts in the middle of it.
+        if len(frame) and frame["date"].iloc[0] < base_data["date"].iloc[0]:
+            frame = frame.iloc[1:].reset_index(drop=True)
+        frames[bar_size] = frame
+    return frames
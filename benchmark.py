@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+from ib_insync import Forex
+
+import bar_cache
+import journal
+import logger
+import metrics
+from backtest import backtest_strategy
+from indicators import IndicatorStream, compute_indicators
+from sim_broker import SimIB, offline_config, synthetic_bars
+
+# Reproducible benchmarks of the hot paths: backtest, indicators and order-ladder construction.
+# Every case runs on seeded synthetic bars and reports the median time of several runs and the
+# peak memory of one traced run. Results can be saved as a baseline and compared later:
+#   python benchmark.py --save      # write benchmark_baseline.json
+#   python benchmark.py --compare   # flag cases slower than the baseline
+
+BASELINE_FILE = "benchmark_baseline.json"
+BACKTEST_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def load_config():
+    with open('config.json') as f:
+        return json.load(f)
+
+def measure(function, repeat):
+    # Median wall time over repeat runs, then peak traced memory of one more run.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"time_s": statistics.median(times), "peak_mb": peak / 2**20, "runs": repeat}
+
+def backtest_cases(config, sizes):
+    cases = {}
+    for n in sizes:
+        data = synthetic_bars(n, seed=42)
+        cases[f"backtest_vectorized_{n}"] = (lambda data=data: backtest_strategy(config, data, vectorized=True), 5 if n < 100000 else 1)
+        # The bar by bar (streaming indicators) mode is the reference, skip it on the largest size.
+        if n < 1000000:
+            cases[f"backtest_stream_{n}"] = (lambda data=data: backtest_strategy(config, data), 5 if n < 100000 else 1)
+    return cases
+
+def indicator_cases(config):
+    import main
+    data = synthetic_bars(10000, seed=42)
+    closes = data["close"].to_numpy()
+
+    def stream_update():
+        indicators = IndicatorStream(config)
+        for close in closes:
+            indicators.update(close)
+
+    # get_parameters against the simulated broker, with a warm bar cache (steady state of the live loop).
+    ib = SimIB({config["pair"]: data}, start=len(data) - 1)
+    contract = Forex(config["pair"])
+    bar_cache.CACHE_DIR = tempfile.mkdtemp()
+    main.get_parameters(ib, config, contract)
+
+    return {
+        "indicators_vectorized_10000": (lambda: compute_indicators(data, config), 5),
+        "indicators_stream_10000": (stream_update, 5),
+        "get_parameters_10000": (lambda: main.get_parameters(ib, config, contract), 5),
+    }
+
+def ladder_cases(config):
+    import main
+    from fibonacci import ladder_template
+    data = synthetic_bars(1000, seed=42)
+    contract = Forex(config["pair"])
+    market_order = SimpleNamespace(order=SimpleNamespace(orderId=0))
+    fill = SimpleNamespace(execution=SimpleNamespace(price=float(data["close"].iloc[-1])))
+    order_info = {"type": "SELL"}
+    highs, lows = data["high"].to_numpy(), data["low"].to_numpy()
+    template = ladder_template(highs, lows, order_info["type"], config)
+
+    def build_ladder_x100():
+        # Signal to submitted ladder: template, then fill prices and orders.
+        ib = SimIB({config["pair"]: data}, start=len(data) - 1)
+        for _ in range(100):
+            template = ladder_template(highs, lows, order_info["type"], config)
+            main.send_ladder(contract, order_info, ib, config, template, market_order, fill)
+
+    def fill_ladder_x100():
+        # Fill to submitted ladder, the template being ready when the market order fills.
+        ib = SimIB({config["pair"]: data}, start=len(data) - 1)
+        for _ in range(100):
+            main.send_ladder(contract, order_info, ib, config, template, market_order, fill)
+
+    return {"ladder_construction_x100": (build_ladder_x100, 5), "ladder_fill_x100": (fill_ladder_x100, 5)}
+
+def run(sizes, groups):
+    # The ladder and get_parameters cases journal orders and record metrics, never into the live files.
+    config = offline_config(load_config())
+    journal.configure(config["Journal_file"])
+    metrics.configure(config["Metrics_file"])
+    # Measure the code, not the logging (which is written by a background thread anyway).
+    logger.configure("WARNING", quiet=True)
+    cases = {}
+    if "backtest" in groups:
+        cases.update(backtest_cases(config, sizes))
+    if "indicators" in groups:
+        cases.update(indicator_cases(config))
+    if "ladder" in groups:
+        cases.update(ladder_cases(config))
+
+    results = {}
+    for name, (function, repeat) in cases.items():
+        results[name] = measure(function, repeat)
+        print(f"{name:<32}{results[name]['time_s']*1000:>12.2f} ms{results[name]['peak_mb']:>10.1f} MB")
+    return results
+
+def compare(results, baseline, threshold):
+    # Print the ratio against the baseline, return the names of the regressed cases.
+    regressions = []
+    print(f"\n{'case':<32}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        base_time = baseline["results"][name]["time_s"]
+        ratio = result["time_s"] / base_time
+        flag = " REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{name:<32}{base_time*1000:>10.2f}ms{result['time_s']*1000:>10.2f}ms{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the backtest, indicators and order ladder.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BACKTEST_SIZES, help="backtest sizes in bars")
+    parser.add_argument("--groups", nargs="+", default=["backtest", "indicators", "ladder"])
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown flagged as regression (0.2 = +20%%)")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.groups)
+
+    if args.compare and os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+    if args.save:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=4)
+        print(f"Baseline saved to {BASELINE_FILE}")
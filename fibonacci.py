@@ -0,0 +1,50 @@
+import numpy as np
+
+# Fibonacci/Martingale ladder shared by the live bot and the backtest. Everything but the fill price
+# of the market order is known when the signal fires: the offsets of the fibonacci orders from the
+# entry, their sizes and the cumulative size of each ladder depth. They are kept in a template so that
+# at the fill only a vector add (limit prices) and a cumulative sum (take profit table) are left.
+
+FIBONACCI_RATIOS = np.array([0.236, 0.382, 0.5, 0.618, 0.786])
+
+
+def ladder_template(highs, lows, side, config):
+    # Template of a ladder entered with a side market order. highs and lows are the bars known
+    # at the signal (numpy arrays), the fibonacci range is taken over the last Fibonacci_duration.
+    duration = config["Fibonacci_duration"]
+    delta_diff = highs[-duration:].max() - lows[-duration:].min()
+    sign = 1.0 if side == "BUY" else -1.0 # BUY ladders buy below the entry, SELL ladders sell above it
+    return dict(ladder_templates(delta_diff, sign, config), side=side)
+
+def ladder_templates(delta_diff, sign, config):
+    # Template of the ladders of fibonacci range delta_diff and sign (+1 BUY, -1 SELL). Both can be
+    # arrays of ladders (the Monte Carlo paths): offsets and tp_factor then get a leading ladder axis.
+    depth = config["Martingale_max"]
+    size = config["Initial_size_trade"]
+    sign = np.asarray(sign, dtype=np.float64)[..., None]
+
+    sizes = np.array([round(size*config["Martingale_multiplier"]**level,4) for level in range(1, depth+1)])
+    # Summed in ladder order, like the position grows
+    cumulative_sizes = np.cumsum(np.concatenate(([size], sizes)))[1:]
+    return {
+        "size": size,
+        "offsets": -sign * (np.asarray(delta_diff)[..., None] * FIBONACCI_RATIOS[:depth]),
+        "sizes": sizes,
+        "cumulative_sizes": cumulative_sizes,
+        "tp_sizes": np.array([round(cumulative_size,4) for cumulative_size in cumulative_sizes.tolist()]),
+        "tp_factor": 1 + sign*config["Take_profit"],
+    }
+
+def ladder_values(template, fill_price, prices):
+    # Value of the position once 0..depth fibonacci orders are filled, the market order included.
+    fill_price = np.asarray(fill_price, dtype=np.float64)[..., None]
+    market = np.broadcast_to(template["size"] * fill_price, prices.shape[:-1] + (1,))
+    return np.cumsum(np.concatenate((market, template["sizes"] * prices), axis=-1), axis=-1)
+
+def ladder_prices(template, fill_price):
+    # Limit prices of the fibonacci orders and take profit of every ladder depth (on the average
+    # price of the filled orders) for a market order filled at fill_price (one per ladder of the template).
+    prices = np.round(np.asarray(fill_price, dtype=np.float64)[..., None] + template["offsets"], 4)
+    values = ladder_values(template, fill_price, prices)[..., 1:]
+    tp_prices = np.round(values / template["cumulative_sizes"] * template["tp_factor"], 4)
+    return prices, tp_prices
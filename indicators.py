@@ -0,0 +1,206 @@
+import math
+from collections import deque
+import numpy as np
+
+
+def detect_cross(prev_sma_small, sma_small, prev_sma_big, sma_big):
+    # Detect MA indicator based on config.json parameters. 
+    if sma_small > sma_big and prev_sma_small < prev_sma_big:
+        return -1  
+    elif sma_small < sma_big and prev_sma_small > prev_sma_big:
+        return 1 
+    return 0
+
+def detect_RSI(rsi, config):
+    # Detect RSI indicator based on config.json parameters.
+    if rsi > config["RSI_high"]:
+        return 1 
+    elif rsi < config["RSI_low"]:
+        return -1
+    return 0
+
+def detect_bollinger(close, bollinger_h, bollinger_l):
+    # Detect Bollinger indicator based on config.json parameters. 
+    if close > bollinger_h:
+        return 1
+    elif close < bollinger_l:
+        return -1
+    return 0
+
+def get_order_type(indicators_sum, config):
+    # Type of the market order to open given the sum of the detected signals, None if the
+    # minimum number of indicators is not met. Counter-trending by default, see Trending in config.json.
+    trending = config["Trending"].lower() == "true"
+    if indicators_sum >= config["minimum_indicators_to_open"]:
+        return "BUY" if trending else "SELL"
+    elif indicators_sum <= -config["minimum_indicators_to_open"]:
+        return "SELL" if trending else "BUY"
+    return None
+
+
+class RollingWindow:
+    # Fixed-size window over the last closes keeping a running mean and sum of squared
+    # deviations (Welford update with removal), so mean and variance are O(1) per bar.
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        if len(self.values) < self.window:
+            # Window still filling up: plain Welford insertion.
+            self.values.append(value)
+            delta = value - self.mean
+            self.mean += delta / len(self.values)
+            self.m2 += delta * (value - self.mean)
+        else:
+            # Window full: replace the oldest value with the new one in a single step.
+            old = self.values.popleft()
+            self.values.append(value)
+            old_mean = self.mean
+            self.mean += (value - old) / self.window
+            self.m2 += (value - old) * (value - self.mean + old - old_mean)
+        if self.m2 < 0:
+            self.m2 = 0.0 # Guard against rounding drift below zero.
+
+    def ready(self):
+        return len(self.values) == self.window
+
+    def get_mean(self):
+        return self.mean if self.ready() else math.nan
+
+    def get_std(self):
+        # Population standard deviation (ddof=0), as used by ta's BollingerBands.
+        return math.sqrt(self.m2 / self.window) if self.ready() else math.nan
+
+
+class WilderRSI:
+    # Wilder-smoothed RSI state, equivalent to ta's RSIIndicator
+    # (ewm with alpha=1/window, adjust=False, min_periods=window).
+    def __init__(self, window):
+        self.window = window
+        self.alpha = 1 / window
+        self.prev_close = None
+        self.avg_up = 0.0
+        self.avg_down = 0.0
+        self.count = 0
+
+    def update(self, close):
+        if self.prev_close is None:
+            # First diff is NaN in ta, which the where() calls turn into 0.
+            up, down = 0.0, 0.0
+        else:
+            diff = close - self.prev_close
+            up = diff if diff > 0 else 0.0
+            down = -diff if diff < 0 else 0.0
+        self.prev_close = close
+
+        if self.count == 0:
+            self.avg_up, self.avg_down = up, down
+        else:
+            # Same arithmetic as pandas' ewm(adjust=False) recursion.
+            old_weight = 1 - self.alpha
+            self.avg_up = (old_weight * self.avg_up + self.alpha * up) / (old_weight + self.alpha)
+            self.avg_down = (old_weight * self.avg_down + self.alpha * down) / (old_weight + self.alpha)
+        self.count += 1
+
+    def get_rsi(self):
+        if self.count < self.window:
+            return math.nan
+        if self.avg_down == 0:
+            return 100.0
+        return 100 - (100 / (1 + self.avg_up / self.avg_down))
+
+
+class IndicatorStream:
+    # Streaming version of the SMA, RSI and Bollinger Bands computed with ta.
+    # Each call to update() consumes one new close and costs O(1), instead of
+    # recomputing every indicator over the whole history.
+    def __init__(self, config):
+        self.sma_small_window = RollingWindow(config["SMA_small_duration"])
+        self.sma_big_window = RollingWindow(config["SMA_big_duration"])
+        self.bollinger_window = RollingWindow(config["bolinger_band_duration"])
+        self.bollinger_std_dev = config["bolinger_band_std_dev"]
+        self.rsi_state = WilderRSI(config["RSI_duration"])
+
+        # Current and previous values, previous ones are needed for the SMA cross.
+        self.close = math.nan
+        self.sma_small = math.nan
+        self.sma_big = math.nan
+        self.prev_sma_small = math.nan
+        self.prev_sma_big = math.nan
+        self.rsi = math.nan
+        self.bollinger_h = math.nan
+        self.bollinger_l = math.nan
+
+    def update(self, close):
+        close = float(close)
+        self.close = close
+
+        self.sma_small_window.update(close)
+        self.sma_big_window.update(close)
+        self.bollinger_window.update(close)
+        self.rsi_state.update(close)
+
+        self.prev_sma_small, self.prev_sma_big = self.sma_small, self.sma_big
+        self.sma_small = self.sma_small_window.get_mean()
+        self.sma_big = self.sma_big_window.get_mean()
+        self.rsi = self.rsi_state.get_rsi()
+
+        bollinger_mavg = self.bollinger_window.get_mean()
+        bollinger_std = self.bollinger_window.get_std()
+        self.bollinger_h = bollinger_mavg + self.bollinger_std_dev * bollinger_std
+        self.bollinger_l = bollinger_mavg - self.bollinger_std_dev * bollinger_std
+
+
+def compute_indicators(historical_data, config):
+    # Compute every indicator once over the full dataset with ta and return them as NumPy arrays.
+    # The indicators only look backwards, so the value at bar i equals the one computed on data up to i.
+    # ta (and pandas) are imported here, the streaming indicators do not need them.
+    from ta.momentum import RSIIndicator
+    from ta.trend import SMAIndicator
+    from ta.volatility import BollingerBands
+    close = historical_data['close']
+    bollinger = BollingerBands(close=close, window=config["bolinger_band_duration"], window_dev=config["bolinger_band_std_dev"])
+    return {
+        "close": close.to_numpy(dtype=float),
+        "sma_small": SMAIndicator(close=close, window=config["SMA_small_duration"]).sma_indicator().to_numpy(),
+        "sma_big": SMAIndicator(close=close, window=config["SMA_big_duration"]).sma_indicator().to_numpy(),
+        "rsi": RSIIndicator(close=close, window=config["RSI_duration"]).rsi().to_numpy(),
+        "bollinger_h": bollinger.bollinger_hband().to_numpy(),
+        "bollinger_l": bollinger.bollinger_lband().to_numpy(),
+    }
+
+def compute_signals(historical_data, config, indicators=None):
+    # Vectorized version of detect_cross, detect_RSI and detect_bollinger over every bar.
+    # Return the three signal arrays (-1, 0, 1), their sum and the mask of bars where a position can be opened.
+    if indicators is None:
+        indicators = compute_indicators(historical_data, config)
+    sma_small, sma_big = indicators["sma_small"], indicators["sma_big"]
+    close = indicators["close"]
+
+    # SMA cross: compare the current bar with the previous one (no cross possible on the first bar).
+    prev_small = np.concatenate(([np.nan], sma_small[:-1]))
+    prev_big = np.concatenate(([np.nan], sma_big[:-1]))
+    cross = np.zeros(len(close), dtype=np.int8)
+    cross[(sma_small > sma_big) & (prev_small < prev_big)] = -1
+    cross[(sma_small < sma_big) & (prev_small > prev_big)] = 1
+
+    rsi = np.zeros(len(close), dtype=np.int8)
+    rsi[indicators["rsi"] > config["RSI_high"]] = 1
+    rsi[indicators["rsi"] < config["RSI_low"]] = -1
+
+    bollinger = np.zeros(len(close), dtype=np.int8)
+    bollinger[close > indicators["bollinger_h"]] = 1
+    bollinger[close < indicators["bollinger_l"]] = -1
+
+    indicators_sum = cross + rsi + bollinger
+    minimum_indicators_to_open = config["minimum_indicators_to_open"]
+    return {
+        "cross": cross,
+        "rsi": rsi,
+        "bollinger": bollinger,
+        "sum": indicators_sum,
+        "open": (indicators_sum >= minimum_indicators_to_open) | (indicators_sum <= -minimum_indicators_to_open),
+    }
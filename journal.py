@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+# Append-only journal of the ladders traded by main.py: one JSON line per order, fill and TP
+# replacement, flushed as soon as it is written. After a crash the open ladders are rebuilt
+# from the journal (and the open orders at IB) instead of being reconciled by hand.
+#
+# Events, all with "time" and "pair" (one ladder per pair at a time):
+#   entry          market order sent: side, size, orderId, net_liquidation
+#   entry_fill     market order filled: price
+#   tp_placed      first take profit: orderId, type, size, price
+#   limits_placed  fibonacci limit orders: orderIds, sizes_tp
+#   limit_fill     limit order filled: orderId, count (limit orders filled so far)
+#   tp_replaced    take profit moved: old_orderId, orderId, size, price
+#   ladder_closed  ladder over: reason (take_profit, drawdown...)
+#   manual_review  orders of a recovered ladder unknown to IB: orderIds (the ladder stays in the journal)
+
+_journal = {"path": None, "file": None}
+
+
+def read_events(path):
+    # Journal events in order. A last line cut by a crash is ignored.
+    events = []
+    if not path or not os.path.exists(path):
+        return events
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+    return events
+
+def replay(events):
+    # Rebuild the open ladders from the events. Return a dict pair -> ladder state.
+    ladders = {}
+    for event in events:
+        pair = event["pair"]
+        kind = event["event"]
+        if kind == "entry":
+            ladders[pair] = {
+                "side": event["side"], "size": event["size"], "entry_orderId": event["orderId"],
+                "net_liquidation": event["net_liquidation"], "entry_price": None,
+                "tp_type": None, "tp_orderId": None, "tp_size": None, "tp_price": None, "limit_orderIds": [], "sizes_tp": {},
+                "filled_limit_orders_count": 0, "events": [],
+            }
+        ladder = ladders.get(pair)
+        if ladder is None:
+            continue
+        ladder["events"].append(event)
+        if kind == "entry_fill":
+            ladder["entry_price"] = event["price"]
+        elif kind == "tp_placed":
+            ladder["tp_type"] = event["type"]
+            ladder["tp_orderId"] = event["orderId"]
+            ladder["tp_size"], ladder["tp_price"] = event["size"], event["price"]
+        elif kind == "limits_placed":
+            ladder["limit_orderIds"] = list(event["orderIds"])
+            # JSON keys are strings, sizes_tp is indexed by the number of filled limit orders
+            ladder["sizes_tp"] = {int(count): details for count, details in event["sizes_tp"].items()}
+        elif kind == "limit_fill":
+            ladder["filled_limit_orders_count"] = event["count"]
+            if event["orderId"] in ladder["limit_orderIds"]:
+                ladder["limit_orderIds"].remove(event["orderId"])
+        elif kind == "tp_replaced":
+            ladder["tp_orderId"] = event["orderId"]
+            ladder["tp_size"], ladder["tp_price"] = event["size"], event["price"]
+        elif kind == "ladder_closed":
+            del ladders[pair]
+    return ladders
+
+def configure(path):
+    # Open the journal for appending (None or "" disables it) and return the open ladders it contains.
+    # The file is compacted first: only the events of the open ladders are kept.
+    close()
+    _journal["path"] = path or None
+    if not _journal["path"]:
+        return {}
+    ladders = replay(read_events(path))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for ladder in ladders.values():
+            for event in ladder["events"]:
+                f.write(json.dumps(event) + "\n")
+    os.replace(tmp_path, path)
+    _journal["file"] = open(path, "a")
+    return ladders
+
+def record(event, pair, **fields):
+    # Append one event, flushed at once so it survives a crash of the process.
+    if _journal["file"] is None:
+        return
+    _journal["file"].write(json.dumps(dict(event=event, time=time.time(), pair=pair, **fields), default=float) + "\n")
+    _journal["file"].flush()
+
+def close():
+    if _journal["file"] is not None:
+        _journal["file"].close()
+        _journal["file"] = None
@@ -0,0 +1,83 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging of the bot and the backtest. Callers only put the log record on a queue, a background
+# thread formats it and writes it to stdout, so logging never blocks the trading or backtest loops.
+# Pass the values as arguments (log.info("Price %s", price)) rather than formatting the message:
+# records below the level are then dropped before any formatting happens.
+
+FORMAT = "[%(asctime)s]\t%(message)s"
+
+log = logging.getLogger("trading_bot")
+# Per-trade events of backtest_strategy, silenced by quiet mode.
+backtest_log = logging.getLogger("trading_bot.backtest")
+# Monitor status line, rewritten in place on the terminal.
+status_log = logging.getLogger("trading_bot.status")
+
+_listener = {"queue": None, "listener": None}
+
+
+class DeferredQueueHandler(QueueHandler):
+    # QueueHandler formats the message in the calling thread, leave that to the writer thread.
+    def prepare(self, record):
+        return record
+
+def _make_handler(stream, terminator, status):
+    handler = logging.StreamHandler(stream)
+    handler.terminator = terminator
+    formatter = logging.Formatter(FORMAT)
+    formatter.default_msec_format = "%s.%03d"
+    handler.setFormatter(formatter)
+    handler.addFilter(lambda record: (record.name == status_log.name) == status)
+    return handler
+
+def setup(stream=None):
+    # Start the background writer, done once on import.
+    if _listener["listener"] is not None:
+        return
+    stream = stream or sys.stdout
+    log_queue = queue.Queue()
+    listener = QueueListener(log_queue, _make_handler(stream, "\n", False), _make_handler(stream, "\r", True))
+    log.addHandler(DeferredQueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    _listener["queue"] = log_queue
+    _listener["listener"] = listener
+    atexit.register(stop)
+
+def setup_worker(stream=None):
+    # In a worker process (sweep, walk-forward) the writer thread of the parent does not run, and
+    # atexit is not called when the worker ends. Workers only log the odd warning: write it directly.
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    _listener["queue"] = None
+    _listener["listener"] = None
+    stream = stream or sys.stdout
+    log.addHandler(_make_handler(stream, "\n", False))
+    log.addHandler(_make_handler(stream, "\r", True))
+
+def configure(level=None, quiet=None):
+    # Set the log level ("DEBUG", "INFO", "WARNING"...) and the backtest quiet mode,
+    # in which only the summary of each backtest is logged.
+    if level:
+        log.setLevel(level.upper())
+    if quiet is not None:
+        backtest_log.setLevel(logging.WARNING if quiet else logging.NOTSET)
+
+def flush():
+    # Wait until every queued record has been written (e.g. before prompting the user).
+    if _listener["queue"] is not None:
+        _listener["queue"].join()
+
+def stop():
+    if _listener["listener"] is not None:
+        _listener["listener"].stop()
+        _listener["listener"] = None
+        _listener["queue"] = None
+
+
+setup()
@@ -1,31 +1,43 @@
 from ib_insync import *
-import json
-from ta.momentum import RSIIndicator
-from ta.trend import SMAIndicator
-from ta.volatility import BollingerBands
-from pyfiglet import Figlet
+import argparse
+import sys
+from bar_cache import get_bars, parse_bar_size
+from fibonacci import ladder_template, ladder_prices
+import journal
+import logger
+import settings
+import metrics
+from logger import log, status_log
+from metrics import span
+from indicators import IndicatorStream, detect_cross, detect_RSI, detect_bollinger, get_order_type
+import asyncio
 import datetime
-from time import sleep
+import time
 
 def welcome():
     # Welcome function
+    from pyfiglet import Figlet # Only needed for the banner, not imported in daemon mode
     f = Figlet(font='small')
     print(f.renderText('404 Profit Not Found'))
     print("\n\n\nWelcome to the trading bot, remember to open your IB Gateway before running the bot!")
     input("Press enter to continue...")
     print("\n\n\n")
 
-def print_strings(string):
-    #Function to print with timestamp
-    print("["+str(datetime.datetime.now())+"]\t"+string)
+def print_strings(string, *args):
+    #Function to log with timestamp, the message is written by the background logger
+    log.info(string, *args)
 
-def boot_IB():
+def boot_IB(ib=None, host=None, port=None, clientId=None):
     # Function attempts to connect to the Interactive Brokers (IB) Gateway
     # and retrieve the account summary information.
+    # An IB-compatible instance (e.g. the simulated broker of sim_broker.py) can be passed instead of IB().
+    # Connection settings not given are read from the environment (see settings.py).
+    host, port, clientId = settings.ib_connection(host, port, clientId)
     try:
         print_strings("IB Gateway connecting...")
-        ib = IB()
-        ib.connect('127.0.0.1', 7497, clientId=1)
+        if ib is None:
+            ib = IB()
+        ib.connect(host, port, clientId=clientId)
         print_strings("IB Gateway connected")
     except:
         print_strings("Error connecting to IB Gateway")
@@ -59,12 +71,12 @@ def boot_IB():
         return None, None
 
         
-def get_config():
-    # Function loads the configuration settings from a 'config.json' file.
+def get_config(path='config.json', overrides=None):
+    # Function loads the configuration settings from a 'config.json' file,
+    # overridden by the TRADING_BOT_* environment variables and the given overrides.
     print_strings("Loading config file...")
     try:
-        with open('config.json') as f:
-            config = json.load(f)
+        config = settings.load_config(path, overrides)
         print_strings("Config file loaded")
         # Check if the Martingale maximum level is within acceptable bounds
         if config["Martingale_max"] <= 5:
@@ -87,10 +99,11 @@ def get_contract(config):
         return None
     # (no need to check for shortability in forex)
 
-def check_parameters(contract, home_currency, ib, initial_funds,config):
+def check_parameters(contract, home_currency, ib, initial_funds,config, daemon=False):
 
     # Function checks whether the selected currency pair is appropriate given the home currency,
     # and whether the maximum potential trades size exceeds the available funds.
+    # In daemon mode (no terminal) an unsafe configuration is only logged.
 
     # Check if the home currency is part of the currency pair
     if home_currency.lower() not in config["pair"].lower():
@@ -121,7 +134,8 @@ def check_parameters(contract, home_currency, ib, initial_funds,config):
     if max_amount > initial_funds*0.9:
         print_strings("PLEASE DECREASE THE MAXIMUM MARTINGALE AMOUNT, MARTINGAL MULTIPLIER OR INITIAL SIZE TRADE.")
         print_strings("IT'S SUGGESTED TO AVOID USING MORE THAN AVAILABLE FUNDS TO AVOID MARGIN CALLS")
-        input("Please close the program....")
+        if not daemon:
+            input("Please close the program....")
         return None # Return None to indicate that the configuration is unsafe
 
     return True # Return True if all checks are passed
@@ -135,9 +149,8 @@ def get_parameters(ib,config,contract):
 
     print_strings("Getting historical data for "+config["pair"]+"...")
     try:
-        bars = ib.reqHistoricalData(
-            contract, endDateTime='', durationStr = config["durationStr"],
-            barSizeSetting= config["barSizeSetting"], whatToShow='MIDPOINT', useRTH=0)
+        # Only the bars newer than the local cache are downloaded, the rest is read from disk
+        myData = get_bars(ib, contract, config, whatToShow='MIDPOINT')
         print_strings("Historical data for "+config["pair"]+" downloaded")
     except:
         print_strings("Error downloading historical data for "+config["pair"])
@@ -145,18 +158,24 @@ def get_parameters(ib,config,contract):
     
     try:
         print_strings("Calculating indicators...")
-        myData = util.df(bars) # Convert bars to a DataFrame
+        from ta.momentum import RSIIndicator
+        from ta.trend import SMAIndicator
+        from ta.volatility import BollingerBands
 
         # Calculate the SMA (Simple Moving Average) for two different window sizes
-        SMA5_series = SMAIndicator(close=myData['close'], window=config["SMA_small_duration"]).sma_indicator()
-        SMA25_series = SMAIndicator(close=myData['close'], window=config["SMA_big_duration"]).sma_indicator()
+        with span("indicator_sma_small", pair=config["pair"]):
+            SMA5_series = SMAIndicator(close=myData['close'], window=config["SMA_small_duration"]).sma_indicator()
+        with span("indicator_sma_big", pair=config["pair"]):
+            SMA25_series = SMAIndicator(close=myData['close'], window=config["SMA_big_duration"]).sma_indicator()
         
         # Calculate the RSI (Relative Strength Index)
-        RSI_series = RSIIndicator(close=myData['close'], window=config["RSI_duration"]).rsi()
+        with span("indicator_rsi", pair=config["pair"]):
+            RSI_series = RSIIndicator(close=myData['close'], window=config["RSI_duration"]).rsi()
         
         # Calculate the Bollinger Bands (upper and lower bands)
-        Bollinger_H_series = BollingerBands(close=myData['close'], window=config["bolinger_band_duration"], window_dev=config["bolinger_band_std_dev"]).bollinger_hband()
-        Bollinger_L_series = BollingerBands(close=myData['close'], window=config["bolinger_band_duration"], window_dev=config["bolinger_band_std_dev"]).bollinger_lband()
+        with span("indicator_bollinger", pair=config["pair"]):
+            Bollinger_H_series = BollingerBands(close=myData['close'], window=config["bolinger_band_duration"], window_dev=config["bolinger_band_std_dev"]).bollinger_hband()
+            Bollinger_L_series = BollingerBands(close=myData['close'], window=config["bolinger_band_duration"], window_dev=config["bolinger_band_std_dev"]).bollinger_lband()
         
         print_strings("Indicators calculated")
     except:
@@ -165,33 +184,23 @@ def get_parameters(ib,config,contract):
 
     return SMA5_series, SMA25_series, RSI_series, Bollinger_H_series, Bollinger_L_series, myData, contract
 
-def get_fibonacci_levels(myData, fill,config):
-    fill_price = fill.execution.price
-    print_strings("Market order filled! PRICE: "+str(fill_price))
-
-    # Determine the highest high and lowest low over the defined duration
-    highest_price = myData['high'].tail(config["Fibonacci_duration"]).max()
-    lowest_price = myData['low'].tail(config["Fibonacci_duration"]).min()
-    
-    # Calculate the difference between the high and low
-    delta_diff = highest_price - lowest_price
-    
-    # Calculate Fibonacci levels with the first order (fill price) sitting at Level 0
-    # This positions the fill price as the central reference point for the Fibonacci retracement levels.
-    retracements = {
-        1: [(fill_price+delta_diff*0.236).round(4),  (fill_price-delta_diff*0.236).round(4)],
-        2: [(fill_price+delta_diff*0.382).round(4),  (fill_price-delta_diff*0.382).round(4)],
-        3: [(fill_price+delta_diff*0.5).round(4),    (fill_price-delta_diff*0.5).round(4)],
-        4: [(fill_price+delta_diff*0.618).round(4),   (fill_price-delta_diff*0.618).round(4)],
-        5: [(fill_price+delta_diff*0.786).round(4),   (fill_price-delta_diff*0.786).round(4)]
-    }
-    
-    print_strings("Fibonacci retracements calculated!")
+def run_strategy(order_type, contract, ib, config, myData, net_liquidation):
+    # Launch the strategy for the detected signal.
+    # Return True if the bot has to stop: drawdown hit, or strategy completed with monitor_forever set to false.
+    order_info = {"type": order_type}
+    if(initiate_strategy(contract, order_info, ib, config, myData, net_liquidation)): #THIS WILL LAUNCH THE STRATEGY
+        #Initiate_strategy return True if the strategy hit a drawdown. The program will stop here.
+        return True
 
-    return retracements, fill_price
+    # Exit the tradingbot if strategy successfull and monitor_forever is set to false
+    return config["monitor_forever"].lower() == "false"
 
 
 def detect_trigger(config,ib,contract,net_liquidation):
+    if config.get("Streaming_bars", "False").lower() == "true":
+        # Event-driven detection on live bars instead of polling the historical data
+        return detect_trigger_streaming(config, ib, contract, net_liquidation)
+
     while True:
         
         # Get the latest data and indicators, sleep if there is an error and check again
@@ -199,75 +208,175 @@ def detect_trigger(config,ib,contract,net_liquidation):
             SMA5_series, SMA25_series, RSI_series, Bollinger_H_series, Bollinger_L_series, myData, contract = get_parameters(ib, config,contract)
         except:
             print_strings("Error getting parameters, retrying...")
-            sleep(config["sleep_time"])
+            ib.sleep(config["sleep_time"])
             continue
         
         # Determine if there's a crossover between the short and long SMAs
-        if SMA5_series.iloc[-1] > SMA25_series.iloc[-1] and SMA5_series.iloc[-2] < SMA25_series.iloc[-2]:
-            cross_value = -1 
-        elif SMA5_series.iloc[-1] < SMA25_series.iloc[-1] and SMA5_series.iloc[-2] > SMA25_series.iloc[-2]:
-            cross_value = 1
-        else:
-            cross_value = 0
-        
+        cross_value = detect_cross(SMA5_series.iloc[-2], SMA5_series.iloc[-1], SMA25_series.iloc[-2], SMA25_series.iloc[-1])
         # Check if the RSI is above or below predefined thresholds
-        if RSI_series.iloc[-1] > config["RSI_high"]:
-            RSI_value = 1
-        elif RSI_series.iloc[-1] < config["RSI_low"]:
-            RSI_value = -1
-        else:
-            RSI_value = 0
-        
+        RSI_value = detect_RSI(RSI_series.iloc[-1], config)
         # Check if the price is above or below the Bollinger Bands
-        if myData['close'].iloc[-1] > Bollinger_H_series.iloc[-1]:
-            bollinger_value = 1
-        elif myData['close'].iloc[-1] < Bollinger_L_series.iloc[-1]:
-            bollinger_value = -1
-        else:
-            bollinger_value = 0
-
+        bollinger_value = detect_bollinger(myData['close'].iloc[-1], Bollinger_H_series.iloc[-1], Bollinger_L_series.iloc[-1])
         
         print_strings(str(abs(cross_value)+abs(RSI_value)+abs(bollinger_value))+" Indicators met")
 
         # Check if the combined indicators suggest opening a position
-        if cross_value + RSI_value + bollinger_value >= config["minimum_indicators_to_open"]:
-            order_info = {}
-            if config["Trending"].lower() == "true":  
-                order_info["type"] = "BUY"  # Enter a buy position if trending
-            else:
-                order_info["type"] = "SELL"   # Enter a sell position if counter-trending
-            
-            if(initiate_strategy(contract, order_info, ib, config, myData, net_liquidation)): #THIS WILL LAUNCH THE STRATEGY
-                #Initiate_strategy return True if the strategy hit a drawdown. The program will stop here.
-                return None  
-
-            if config["monitor_forever"].lower() == "false":
-                # Exit the tradingbot if strategy successfull and monitor_forever is set to false
-                break 
-            else:
-                #if monitor_forever is set to true, sleep for the specified time before starting the strategy again
-                sleep(config["sleep_time"]) 
-    
-        elif cross_value + RSI_value + bollinger_value <= -config["minimum_indicators_to_open"]:
-            order_info = {}
-            if config["Trending"].lower() == "true":
-                order_info["type"] = "SELL" # Enter a sell position if trending
-            else:
-                order_info["type"] = "BUY" # Enter a buy position if counter-trending
-            
-            if(initiate_strategy(contract, order_info, ib, config, myData, net_liquidation)):  #THIS WILL LAUNCH THE STRATEGY
-                #Initiate_strategy return True if the strategy hit a drawdown. The program will stop here.
+        order_type = get_order_type(cross_value + RSI_value + bollinger_value, config)
+        if order_type is not None:
+            if run_strategy(order_type, contract, ib, config, myData, net_liquidation):
                 return None
-            
-            if config["monitor_forever"].lower() == "false":
-                # Exit the tradingbot if strategy successfull and monitor_forever is set to false
-                break
-            else:
-                #if monitor_forever is set to true, sleep for the specified time before starting the strategy again
-                sleep(config["sleep_time"])
+            #if monitor_forever is set to true, sleep for the specified time before starting the strategy again
+            ib.sleep(config["sleep_time"]) 
 
         else:
-            sleep(config["sleep_time"]) # No trigger met, continue monitoring
+            ib.sleep(config["sleep_time"]) # No trigger met, continue monitoring
+
+
+def subscription_bar_size(config):
+    # Bar size of the live subscription: the base bars when they are resampled locally.
+    return config.get("Base_barSizeSetting") or config["barSizeSetting"]
+
+def completed_bars_df(bars, config):
+    # DataFrame of the completed bars of the subscription, resampled to barSizeSetting if needed.
+    myData = util.df(bars[:-1])
+    if subscription_bar_size(config) != config["barSizeSetting"]:
+        from resample import resample
+        myData = resample(myData, parse_bar_size(config["barSizeSetting"]))
+    return myData
+
+def watch_signals(bars, config, signals, on_signal=None):
+    # Update and evaluate the indicators as soon as a bar of the keepUpToDate bar list is completed.
+    # Detected order types are appended to signals. Return the handler attached to the bar updates.
+    # With Base_barSizeSetting the base bars are resampled on the fly and the indicators are
+    # updated with the barSizeSetting bars.
+    indicators = IndicatorStream(config)
+    resampler = None
+    if subscription_bar_size(config) != config["barSizeSetting"]:
+        from resample import Resampler, to_epoch
+        resampler = Resampler(parse_bar_size(config["barSizeSetting"]), parse_bar_size(subscription_bar_size(config)))
+
+    def add_bar(bar):
+        # Feed a completed bar, return True if the indicators got a new bar
+        if resampler is None:
+            indicators.update(bar.close)
+            return True
+        completed = resampler.update(int(to_epoch([bar.date])[0]), bar.open, bar.high, bar.low, bar.close, bar.volume, bar.average, bar.barCount)
+        for coarse_bar in completed:
+            indicators.update(coarse_bar[4])
+        return len(completed) > 0
+
+    # Warm up the indicators with the completed bars, the last bar is still forming
+    for bar in bars[:-1]:
+        add_bar(bar)
+
+    def on_bar_update(bars, hasNewBar):
+        # A new bar means the previous one is completed: update and evaluate the indicators at once
+        if not hasNewBar or not add_bar(bars[-2]):
+            return
+        cross_value = detect_cross(indicators.prev_sma_small, indicators.sma_small, indicators.prev_sma_big, indicators.sma_big)
+        RSI_value = detect_RSI(indicators.rsi, config)
+        bollinger_value = detect_bollinger(indicators.close, indicators.bollinger_h, indicators.bollinger_l)
+        print_strings(str(abs(cross_value)+abs(RSI_value)+abs(bollinger_value))+" Indicators met for "+config["pair"])
+
+        order_type = get_order_type(cross_value + RSI_value + bollinger_value, config)
+        if order_type is not None:
+            signals.append(order_type)
+            if on_signal is not None:
+                on_signal()
+
+    bars.updateEvent += on_bar_update
+    return on_bar_update
+
+def detect_trigger_streaming(config, ib, contract, net_liquidation):
+    # Subscribe to the historical bars kept up to date by IB: the indicators are updated and
+    # evaluated as soon as a bar is completed, instead of downloading the history every sleep_time.
+    print_strings("Subscribing to live bars for "+config["pair"]+"...")
+    bars = ib.reqHistoricalData(
+        contract, endDateTime='', durationStr=config["durationStr"],
+        barSizeSetting=subscription_bar_size(config), whatToShow='MIDPOINT', useRTH=0, formatDate=2, keepUpToDate=True)
+    print_strings("Live bars for "+config["pair"]+" subscribed")
+
+    signals = [] # Order types detected on completed bars, waiting to be executed
+    on_bar_update = watch_signals(bars, config, signals)
+
+    try:
+        while True:
+            ib.waitOnUpdate() # Wake up on every incoming message instead of sleeping sleep_time
+            if not signals:
+                continue
+
+            # The strategy only needs the DataFrame for the Fibonacci levels, build it once a signal fires
+            myData = completed_bars_df(bars, config)
+            if run_strategy(signals[-1], contract, ib, config, myData, net_liquidation):
+                return None
+            # Signals of bars completed while the strategy was running are discarded
+            signals.clear()
+    finally:
+        bars.updateEvent -= on_bar_update
+        ib.cancelHistoricalData(bars)
+
+
+def get_pair_configs(config):
+    # One config per traded pair: the pairs listed in "pairs" if any, otherwise the single "pair".
+    return [dict(config, pair=pair) for pair in config.get("pairs", [config["pair"]])]
+
+async def trade_pair(ib, config, contract, net_liquidation, stop, ladder=None, new_entries=True):
+    # Strategy loop of one pair when several pairs are traded at once. Each pair has its own bars,
+    # indicators and ladder, and only waits on the shared event loop so the other pairs keep running.
+    # Return True if the strategy hit a drawdown, setting stop to end the detection on every pair.
+    # ladder is a ladder recovered from the journal, monitored before looking for new signals.
+    # Without new_entries (unsafe parameters) only the recovered ladder is monitored.
+    if ladder is not None:
+        if await monitor_and_check_orders_async(ib, contract, config=config, **ladder):
+            stop.set()
+            return True
+    if not new_entries or (ladder is not None and config["monitor_forever"].lower() == "false"):
+        return False
+    print_strings("Subscribing to live bars for "+config["pair"]+"...")
+    bars = await ib.reqHistoricalDataAsync(
+        contract, endDateTime='', durationStr=config["durationStr"],
+        barSizeSetting=subscription_bar_size(config), whatToShow='MIDPOINT', useRTH=0, formatDate=2, keepUpToDate=True)
+    print_strings("Live bars for "+config["pair"]+" subscribed")
+
+    signals = []
+    new_signal = asyncio.Event()
+    on_bar_update = watch_signals(bars, config, signals, new_signal.set)
+    stop_task = asyncio.ensure_future(stop.wait())
+
+    try:
+        while True:
+            signal_task = asyncio.ensure_future(new_signal.wait())
+            await asyncio.wait([signal_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+            if stop.is_set():
+                signal_task.cancel()
+                return False
+            new_signal.clear()
+            if not signals:
+                continue
+
+            myData = completed_bars_df(bars, config)
+            if await initiate_strategy_async(contract, {"type": signals[-1]}, ib, config, myData, net_liquidation):
+                stop.set()
+                return True
+            if config["monitor_forever"].lower() == "false":
+                return False
+            # Signals of bars completed while the strategy was running are discarded
+            signals.clear()
+            new_signal.clear()
+    finally:
+        stop_task.cancel()
+        bars.updateEvent -= on_bar_update
+        ib.cancelHistoricalData(bars)
+
+def run_pairs(pair_configs, contracts, ib, net_liquidation, recovered=None, new_entries=True):
+    # Trade every pair concurrently on the same IB connection and asyncio event loop.
+    # recovered maps pairs to the ladders recovered from the journal.
+    # Without new_entries the recovered ladders are monitored to the end, nothing new is opened.
+    recovered = recovered or {}
+    async def run_all():
+        stop = asyncio.Event()
+        await asyncio.gather(*(trade_pair(ib, pair_config, contract, net_liquidation, stop, recovered.get(pair_config["pair"]), new_entries) for pair_config, contract in zip(pair_configs, contracts)))
+    ib.run(run_all())
 
 
 def initiate_strategy(contract, order_info, ib, config, myData, net_liquidation):
@@ -275,31 +384,29 @@ def initiate_strategy(contract, order_info, ib, config, myData, net_liquidation)
     
     # Place the market order through the Interactive Brokers
     order = MarketOrder(order_info["type"], config["Initial_size_trade"])
+    sent_time = time.perf_counter()
     trade = ib.placeOrder(contract, order)
+    journal.record("entry", config["pair"], side=order_info["type"], size=config["Initial_size_trade"], orderId=trade.order.orderId, net_liquidation=net_liquidation)
     print_strings("Market order sent!")
 
-    retracements = None # To store Fibonacci retracement levels
-    fill_processed = [False] # Track whether the order fill has been processed
-    fill_price = None # To store the price at which the order is filled
+    # Everything of the ladder but the fill price, computed while the market order is on its way
+    template = ladder_template(myData['high'].to_numpy(), myData['low'].to_numpy(), order_info["type"], config)
+    ladder = [] # TP and limit orders, submitted by the fill handler
 
     # Define a function to handle the order fill event
     def on_fill(trade, fill):
-        nonlocal retracements, fill_price
-        retracements, fill_price = get_fibonacci_levels(myData, fill, config) # Calculate Fibonacci levels
-        fill_processed[0] = True  # Mark the fill as processed
+        if not ladder:
+            metrics.observe("market_order_fill", time.perf_counter() - sent_time, pair=config["pair"])
+            ladder.append(send_ladder(contract, order_info, ib, config, template, trade, fill))
     
     # Attach the on_fill function to the trade's fill event
     trade.fillEvent += on_fill  
     
-    # Wait until the order is filled and processed
-    while not fill_processed[0]:
-        ib.sleep(0.5)
-
-    # Send a take-profit order based on the filled price
-    tp_type, tp_trade = send_tp(order_info,fill_price,ib,config,contract)
-    
-    # Send limit orders for additional trades based on Fibonacci retracement levels
-    sizes_tp, limit_trades = send_limit_orders(order_info, config,ib,retracements,contract,fill_price)
+    # Wait for the fill, the ladder is sent as soon as it arrives
+    while not ladder:
+        ib.waitOnUpdate()
+    trade.fillEvent -= on_fill
+    tp_type, sizes_tp, tp_trade, limit_trades = ladder[0]
 
     # Monitor and manage the orders, checking against the net liquidation value
     if(monitor_and_check_orders(ib, contract, order_info, config, tp_type, sizes_tp, tp_trade, limit_trades, net_liquidation)):
@@ -307,6 +414,47 @@ def initiate_strategy(contract, order_info, ib, config, myData, net_liquidation)
   
 
 
+async def initiate_strategy_async(contract, order_info, ib, config, myData, net_liquidation):
+    # Same as initiate_strategy, waiting for the fill without blocking the other pairs on the event loop.
+    print_strings("Sending market order: SIZE: "+str(config["Initial_size_trade"])+" TYPE: "+order_info["type"]+" PAIR: "+config["pair"])
+    
+    order = MarketOrder(order_info["type"], config["Initial_size_trade"])
+    sent_time = time.perf_counter()
+    trade = ib.placeOrder(contract, order)
+    journal.record("entry", config["pair"], side=order_info["type"], size=config["Initial_size_trade"], orderId=trade.order.orderId, net_liquidation=net_liquidation)
+    print_strings("Market order sent!")
+
+    template = ladder_template(myData['high'].to_numpy(), myData['low'].to_numpy(), order_info["type"], config)
+    # Wait for the fill event of the market order, the ladder is sent by the handler
+    ladder = asyncio.get_running_loop().create_future()
+    def on_fill(trade, fill):
+        if not ladder.done():
+            metrics.observe("market_order_fill", time.perf_counter() - sent_time, pair=config["pair"])
+            ladder.set_result(send_ladder(contract, order_info, ib, config, template, trade, fill))
+    trade.fillEvent += on_fill
+    tp_type, sizes_tp, tp_trade, limit_trades = await ladder
+    trade.fillEvent -= on_fill
+
+    if(await monitor_and_check_orders_async(ib, contract, order_info, config, tp_type, sizes_tp, tp_trade, limit_trades, net_liquidation)):
+        return True #return True if the strategy hit a drawdown
+
+
+def send_ladder(contract, order_info, ib, config, template, trade, fill):
+    # Submit the take profit and every fibonacci limit order in one burst from the fill handler,
+    # without waiting for the broker in between. The orders share an orderRef naming the ladder.
+    # The ladder template (see fibonacci.py) only needs to be shifted by the fill price.
+    # Return tp_type, sizes_tp, tp_trade and limit_trades.
+    fill_price = fill.execution.price
+    prices, tp_prices = ladder_prices(template, fill_price)
+    print_strings("Market order filled! PRICE: "+str(fill_price))
+    journal.record("entry_fill", config["pair"], price=fill_price)
+    order_info = dict(order_info, ref=f"{config['pair']} ladder {trade.order.orderId}")
+    # Send a take-profit order based on the filled price
+    tp_type, tp_trade = send_tp(order_info,fill_price,ib,config,contract)
+    # Send limit orders for additional trades at the Fibonacci retracement levels
+    sizes_tp, limit_trades = send_limit_orders(order_info, config,ib,contract,template,prices,tp_prices)
+    return tp_type, sizes_tp, tp_trade, limit_trades
+
 def send_tp(order_info, price, ib, config,contract):
     tp_trade = [] # List to hold the take-profit trade
     if order_info["type"] == "BUY": 
@@ -322,69 +470,55 @@ def send_tp(order_info, price, ib, config,contract):
 
     print_strings("Placing take profit: SIZE: "+ str(config["Initial_size_trade"])+" TYPE: "+order_type+" PRICE: "+str(price_limit))
     # Create a limit order for the take-profit
-    order = LimitOrder(order_type, config["Initial_size_trade"], price_limit)
+    order = LimitOrder(order_type, config["Initial_size_trade"], price_limit, orderRef=order_info.get("ref", ""))
     # Place the take-profit order with Interactive Brokers
     trade = ib.placeOrder(contract, order)
+    journal.record("tp_placed", config["pair"], orderId=trade.order.orderId, type=order_type, size=config["Initial_size_trade"], price=price_limit)
     # Append the trade to the tp_trade list
     tp_trade.append(trade)
     print_strings("Take profit placed!")
     return order_type, tp_trade
 
-def send_limit_orders(order_info, config,ib,retracements,contract,fill_price):
+def send_limit_orders(order_info, config,ib,contract,template,prices,tp_prices):
+    # Place the Martingale limit orders at the fibonacci prices of the ladder.
+    # Return the cumulative trade sizes and take-profit prices of each ladder depth, and the limit trades.
     sizes_tp = {} # Dictionary to store cumulative trade sizes and their corresponding take-profit prices
-    cumulative_size = config["Initial_size_trade"]
-    total_value = config["Initial_size_trade"] * fill_price
-    
     limit_trades = [] # List to keep track of all limit trades
 
-    # Loop to place a series of limit orders based on the Martingale strategy
-    for i in range(1,config["Martingale_max"]+1):
-        # Determine the limit price for the order based on the retracement levels
-        if order_info["type"] == "BUY":
-            price_limit = retracements[i][1]
-        else:
-            price_limit = retracements[i][0]
-        
-        # Calculate the size of the order based on the Martingale multiplier
-        size = round(config["Initial_size_trade"]*config["Martingale_multiplier"]**i,4)
+    for size, price_limit in zip(template["sizes"].tolist(), prices.tolist()):
         # Create and place the limit order through the Interactive Brokers 
         print_strings("Placing limit order: SIZE: "+str(size)+" TYPE: "+order_info["type"]+" PRICE: "+str(price_limit))
-        order = LimitOrder(order_info["type"], size, price_limit)
+        order = LimitOrder(order_info["type"], size, price_limit, orderRef=order_info.get("ref", ""))
         trade = ib.placeOrder(contract, order)
         limit_trades.append(trade) # Add the trade to the limit_trades list
         print_strings("Limit order placed!")
 
-        # Update cumulative size and total value after placing the new limit order
-        cumulative_size += size
-        total_value += size * price_limit
-        # Calculate the new average price after placing the limit order
-        average_price = total_value / cumulative_size
-        # Determine the take-profit price based on the average price and the order type
-        if order_info["type"] == "BUY":
-            tp_price = average_price * (1 + config["Take_profit"])
-        else:  
-            tp_price = average_price * (1 - config["Take_profit"])
-
-        # Store the cumulative size and corresponding take-profit price in sizes_tp
-        sizes_tp[i] = {'tp_size': round(cumulative_size,4), 'tp_price': round(tp_price,4)}
+    for i, (tp_size, tp_price) in enumerate(zip(template["tp_sizes"].tolist(), tp_prices.tolist()), start=1):
+        # Take profit once i limit orders are filled, on the average price of the position
+        sizes_tp[i] = {'tp_size': tp_size, 'tp_price': tp_price}
     
+    journal.record("limits_placed", config["pair"], orderIds=[trade.order.orderId for trade in limit_trades], sizes_tp=sizes_tp)
     # Return the dictionary of sizes and take-profit prices, and the list of limit trades
     return sizes_tp, limit_trades
 
-def monitor_and_check_orders(ib, contract, order_info, config, tp_type, sizes_tp, tp_trade,  limit_trades, net_liquidation):
-    # Warning: This function has more moving parts than a Swiss watch!
-    # Prepare yourself for a wild ride through order management and drawdown control.
-
-    take_profit_filled = False
-    filled_limit_orders_count = 0  # Counter for filled limit orders
-    canceled_orders = set()  # Track canceled orders
-
-    important_trades = tp_trade + limit_trades
+def start_monitoring(ib, contract, config, tp_type, sizes_tp, tp_trade, limit_trades, filled_count=0):
+    # Attach the order status handler to the TP and limit orders.
+    # Return the ladder state updated by the handler (and read by check_drawdown).
+    # filled_count is the number of limit orders already filled (ladder recovered from the journal).
+    state = {
+        "take_profit_filled": False,
+        "filled_limit_orders_count": filled_count, # Counter for filled limit orders
+        "canceled_orders": set(), # Track canceled orders
+        "important_trades": tp_trade + limit_trades,
+        "drawdown_hit": False,
+        "last_percentage": None, # Last balance change shown on the status line
+    }
+    important_trades = state["important_trades"]
+    canceled_orders = state["canceled_orders"]
     
     print_strings(f"Monitoring {len(important_trades)} relevant trades...") 
 
     def handle_order_status(trade):
-        nonlocal filled_limit_orders_count, take_profit_filled
           
         if trade.orderStatus.status == 'Filled':
             
@@ -392,11 +526,12 @@ def monitor_and_check_orders(ib, contract, order_info, config, tp_type, sizes_tp
             
             if trade in tp_trade:
                 print_strings("Take profit filled! Cancelling all other orders.")
+                journal.record("ladder_closed", config["pair"], reason="take_profit")
                 for other_trade in limit_trades:
                             ib.cancelOrder(other_trade.order) # Cancel all limit orders if TP is hit
                             canceled_orders.add(other_trade.order.orderId)
                             print_strings(f"Order {other_trade.order.orderId} cancelled.")
-                take_profit_filled = True
+                state["take_profit_filled"] = True
 
                 return False #Means that drawdown was not hit
             
@@ -404,76 +539,304 @@ def monitor_and_check_orders(ib, contract, order_info, config, tp_type, sizes_tp
 
                 limit_trades.remove(trade)
                 
-                filled_limit_orders_count += 1
-                print_strings(f"{filled_limit_orders_count}st limit order filled! Adjusting TP price.")
-                
-                tp_details = sizes_tp[filled_limit_orders_count]
-
-                tp_old = tp_trade[0]
-                tp_trade.remove(tp_old)
-                
-                ib.cancelOrder(tp_old.order) # Cancel the old TP order
-                canceled_orders.add(tp_old.order.orderId)
-                print_strings(f"Order {tp_old.order.orderId} cancelled.")
-                
-                new_order = LimitOrder(tp_type, tp_details['tp_size'], tp_details['tp_price']) # Place a new TP order
-                new_tp = ib.placeOrder(contract, new_order)
+                replace_start = time.perf_counter()
+                state["filled_limit_orders_count"] += 1
+                journal.record("limit_fill", config["pair"], orderId=trade.order.orderId, count=state["filled_limit_orders_count"])
+                print_strings(f"{state['filled_limit_orders_count']}st limit order filled! Adjusting TP price.")
                 
-                tp_trade.append(new_tp)
-
-                new_tp.statusEvent += handle_order_status  # Attach the status handler to the new order
-                important_trades.append(new_tp)
-
-                print_strings(f"New TP order placed: SIZE {tp_details['tp_size']} PRICE {tp_details['tp_price']}")
+                tp_details = sizes_tp[state["filled_limit_orders_count"]]
+
+                # Modify the TP in place (same orderId): the position stays covered by the old
+                # quantity and price until the broker applies the new ones.
+                tp = tp_trade[0]
+                tp.order.totalQuantity = tp_details['tp_size']
+                tp.order.lmtPrice = tp_details['tp_price']
+
+                # Time until the broker acknowledges this modification, the replace round trip. Modifications
+                # are acknowledged in order, so this one is acknowledged with the n-th 'Modified' of the TP log
+                # (n-th 'Modify' sent), not by the ack of an earlier modification still on its way.
+                # The handler detaches itself once acknowledged (emit iterates over a copy of the handlers).
+                modification = sum(entry.message == 'Modify' for entry in tp.log) + 1
+                def on_tp_ack(modified):
+                    if modified.orderStatus.status == 'Filled' or sum(entry.message == 'Modified' for entry in modified.log) >= modification:
+                        modified.statusEvent -= on_tp_ack
+                        metrics.observe("tp_replace_ack", time.perf_counter() - replace_start, pair=config["pair"])
+                tp.statusEvent += on_tp_ack
+
+                ib.placeOrder(contract, tp.order)
+                metrics.observe("tp_replace", time.perf_counter() - replace_start, pair=config["pair"])
+                journal.record("tp_replaced", config["pair"], old_orderId=tp.order.orderId, orderId=tp.order.orderId, size=tp_details['tp_size'], price=tp_details['tp_price'])
+
+                print_strings(f"TP order {tp.order.orderId} modified: SIZE {tp_details['tp_size']} PRICE {tp_details['tp_price']}")
 
     for trade in important_trades:
         trade.statusEvent += handle_order_status  # Start monitoring each trade's status
         print_strings(f"Trade {trade.order.orderId} monitoring started!")  
 
-    while not take_profit_filled:
-        for trade in important_trades:
-            myAccount = ib.accountSummary()
-            try:
-                for item in myAccount:
-                    if item.tag == "NetLiquidation":
-                        new_liquidation = float(item.value)
-
-                # Check if net liquidation has dropped below the max drawdown threshold
-                if new_liquidation < net_liquidation*(1-config["Max_drawdown"]):
-                    print_strings("Max drawdown reached, closing all orders...")
-                    # Cancel all open orders if the drawdown threshold is reached
-                    for trade in important_trades:
-                        ib.cancelOrder(trade.order)
-                        canceled_orders.add(trade.order.orderId)
-                        print_strings(f"Order {trade.order.orderId} cancelled.")
-                    
-                    # Place a market order to close the first market order
-                    if filled_limit_orders_count == 0:
-                        config["Initial_size_trade"]
-                        new_order = MarketOrder(tp_type, config["Initial_size_trade"])
-                        new_tp = ib.placeOrder(contract, new_order)
-                        print_strings(f"Market order placed: SIZE {config["Initial_size_trade"]} TYPE {tp_type}")
-                        return True #Return True if the strategy hit a drawdown
-                    
-                    #Place a market order to close firt market order and following limit orders
-                    else:
-                        filled_limit_orders_count += 1
-                        tp_details = sizes_tp[filled_limit_orders_count]
-                        new_order = MarketOrder(tp_type, tp_details['tp_size'])
-                        new_tp = ib.placeOrder(contract, new_order)
-                        print_strings(f"Market order placed: SIZE {tp_details['tp_size']} TYPE {tp_type}")
-                        return True #Return True if the strategy hit a drawdown
-                
-                else:
-                    percentage_cg = round((new_liquidation - net_liquidation) / net_liquidation,4)*100 
-                    print("["+str(datetime.datetime.now())+"]\t"+"Monitoring open orders and balance ["+str(percentage_cg)+"%]", end='\r')
-            
-            except:
-                print_strings("Error getting account information")
-            
+    return state
 
-            ib.sleep(config["Monitoring_order_sleep"]) #sleep for the specified time before checking the orders again
+def read_net_liquidation(myAccount):
+    # NetLiquidation value of an account summary.
+    for item in myAccount:
+        if item.tag == "NetLiquidation":
+            return float(item.value)
 
+def check_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation):
+    # Poll the net liquidation and check it against the max drawdown.
+    # Return True if the strategy hit a drawdown.
+    try:
+        new_liquidation = read_net_liquidation(ib.accountSummary())
+        return apply_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, new_liquidation)
+    
+    except:
+        print_strings("Error getting account information")
+    return False
+
+async def check_drawdown_async(ib, contract, config, tp_type, sizes_tp, state, net_liquidation):
+    # Same as check_drawdown from the event loop: the blocking accountSummary can not run the loop again.
+    try:
+        new_liquidation = read_net_liquidation(await ib.accountSummaryAsync())
+        return apply_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, new_liquidation)
+
+    except:
+        print_strings("Error getting account information")
+    return False
+
+def apply_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, new_liquidation):
+    # Check the net liquidation against the max drawdown, closing every order and the position if it is hit.
+    # Return True if the strategy hit a drawdown.
+
+    # Check if net liquidation has dropped below the max drawdown threshold
+    if new_liquidation < net_liquidation*(1-config["Max_drawdown"]):
+        print_strings("Max drawdown reached, closing all orders...")
+        state["drawdown_hit"] = True
+        journal.record("ladder_closed", config["pair"], reason="drawdown")
+        # Cancel all open orders if the drawdown threshold is reached
+        for trade in state["important_trades"]:
+            ib.cancelOrder(trade.order)
+            state["canceled_orders"].add(trade.order.orderId)
+            print_strings(f"Order {trade.order.orderId} cancelled.")
+        
+        # Place a market order to close the first market order
+        if state["filled_limit_orders_count"] == 0:
+            new_order = MarketOrder(tp_type, config["Initial_size_trade"])
+            new_tp = ib.placeOrder(contract, new_order)
+            print_strings(f"Market order placed: SIZE {config['Initial_size_trade']} TYPE {tp_type}")
+            return True #Return True if the strategy hit a drawdown
+        
+        #Place a market order to close firt market order and following limit orders
+        else:
+            # The open position is the cumulative size of the filled limit orders
+            tp_details = sizes_tp[state["filled_limit_orders_count"]]
+            new_order = MarketOrder(tp_type, tp_details['tp_size'])
+            new_tp = ib.placeOrder(contract, new_order)
+            print_strings(f"Market order placed: SIZE {tp_details['tp_size']} TYPE {tp_type}")
+            return True #Return True if the strategy hit a drawdown
+    
+    else:
+        percentage_cg = round((new_liquidation - net_liquidation) / net_liquidation,4)*100 
+        # Rewrite the status line only when the balance changes
+        if percentage_cg != state["last_percentage"]:
+            state["last_percentage"] = percentage_cg
+            status_log.info("Monitoring open orders and balance [%s%%]", percentage_cg)
+    return False
+
+# Number of monitored ladders sharing the PnL subscription of each account.
+_pnl_users = {}
+
+def subscribe_pnl(ib, account):
+    # IB accepts one PnL subscription per account: it is requested once per connection and
+    # shared through pnlEvent by every monitored ladder (pairs in multi-pair mode).
+    if not ib.pnl(account):
+        ib.reqPnL(account)
+    _pnl_users[account] = _pnl_users.get(account, 0) + 1
+
+def unsubscribe_pnl(ib, account):
+    # Cancel the PnL subscription once the last ladder using it is over.
+    _pnl_users[account] -= 1
+    if _pnl_users[account] == 0:
+        del _pnl_users[account]
+        ib.cancelPnL(account)
+
+def subscribe_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, myAccount):
+    # Event-driven drawdown check: react to the NetLiquidation values pushed by IB (account summary
+    # and account updates) and to the PnL updates, checking Max_drawdown only when the value changes.
+    # myAccount is the current account summary, read by the caller (from the event loop with accountSummaryAsync).
+    # Return a function removing the subscriptions.
+    last_liquidation = [None]
+    # NetLiquidation and daily PnL of the last account update, used to estimate the
+    # net liquidation from the (more frequent) PnL updates in between.
+    reference = {"liquidation": None, "daily_pnl": None}
+
+    def check_value(new_liquidation):
+        if state["take_profit_filled"] or state["drawdown_hit"] or new_liquidation == last_liquidation[0]:
+            return
+        last_liquidation[0] = new_liquidation
+        apply_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, new_liquidation)
+
+    last_daily_pnl = [None]
+
+    def on_account_value(value):
+        if value.tag != "NetLiquidation":
+            return
+        reference["liquidation"] = float(value.value)
+        reference["daily_pnl"] = last_daily_pnl[0]
+        check_value(reference["liquidation"])
+
+    def on_pnl(pnl):
+        if pnl.account != account or pnl.dailyPnL != pnl.dailyPnL: # NaN until IB has a value
+            return
+        last_daily_pnl[0] = pnl.dailyPnL
+        if reference["daily_pnl"] is None:
+            reference["daily_pnl"] = pnl.dailyPnL
+        if reference["liquidation"] is not None:
+            check_value(reference["liquidation"] + pnl.dailyPnL - reference["daily_pnl"])
+
+    account = ib.managedAccounts()[0]
+
+    # Start from the current value, then only react to updates
+    for item in myAccount:
+        if item.tag == "NetLiquidation":
+            on_account_value(item)
+
+    ib.accountSummaryEvent += on_account_value
+    ib.accountValueEvent += on_account_value
+    subscribe_pnl(ib, account)
+    ib.pnlEvent += on_pnl
+
+    def unsubscribe():
+        ib.accountSummaryEvent -= on_account_value
+        ib.accountValueEvent -= on_account_value
+        ib.pnlEvent -= on_pnl
+        unsubscribe_pnl(ib, account)
+    return unsubscribe
+
+def monitor_and_check_orders(ib, contract, order_info, config, tp_type, sizes_tp, tp_trade,  limit_trades, net_liquidation, filled_count=0):
+    # Warning: This function has more moving parts than a Swiss watch!
+    # Prepare yourself for a wild ride through order management and drawdown control.
+    state = start_monitoring(ib, contract, config, tp_type, sizes_tp, tp_trade, limit_trades, filled_count)
+
+    if config.get("Drawdown_events", "False").lower() == "true":
+        # Drawdown checked by the account/PnL update handlers, just wait for events
+        unsubscribe = subscribe_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, ib.accountSummary())
+        try:
+            while not state["take_profit_filled"] and not state["drawdown_hit"]:
+                ib.waitOnUpdate(timeout=config["Monitoring_order_sleep"])
+        finally:
+            unsubscribe()
+        return state["drawdown_hit"]
+
+    while not state["take_profit_filled"]:
+        if check_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation):
+            return True #Return True if the strategy hit a drawdown
+        ib.sleep(config["Monitoring_order_sleep"]) #sleep for the specified time before checking the orders again
+
+async def monitor_and_check_orders_async(ib, contract, order_info, config, tp_type, sizes_tp, tp_trade,  limit_trades, net_liquidation, filled_count=0):
+    # Same as monitor_and_check_orders, waiting without blocking the other pairs on the event loop.
+    state = start_monitoring(ib, contract, config, tp_type, sizes_tp, tp_trade, limit_trades, filled_count)
+
+    if config.get("Drawdown_events", "False").lower() == "true":
+        unsubscribe = subscribe_drawdown(ib, contract, config, tp_type, sizes_tp, state, net_liquidation, await ib.accountSummaryAsync())
+        try:
+            while not state["take_profit_filled"] and not state["drawdown_hit"]:
+                await asyncio.sleep(config["Monitoring_order_sleep"]) # Only reads the flags, no request
+        finally:
+            unsubscribe()
+        return state["drawdown_hit"]
+
+    while not state["take_profit_filled"]:
+        if await check_drawdown_async(ib, contract, config, tp_type, sizes_tp, state, net_liquidation):
+            return True #Return True if the strategy hit a drawdown
+        await asyncio.sleep(config["Monitoring_order_sleep"])
+
+
+# Returned by recover_ladder for a ladder whose orders IB can not account for.
+MANUAL_REVIEW = "manual_review"
+
+def order_outcome(orderId, open_trades, trades, filled_orders):
+    # What became of an order of a recovered ladder: "open", "filled", "cancelled", or None when IB
+    # does not tell (order unknown to the session, partially filled then cancelled).
+    # trades includes the completed orders ib_insync syncs at connect, fills only the recent executions.
+    if orderId in open_trades:
+        return "open"
+    trade = trades.get(orderId)
+    if trade is None:
+        return "filled" if orderId in filled_orders else None
+    if trade.orderStatus.status == "Filled":
+        return "filled"
+    if trade.orderStatus.status in OrderStatus.DoneStates and trade.orderStatus.filled == 0:
+        return "cancelled"
+    return None
+
+def recover_ladder(ib, config, contract, ladder):
+    # Rebuild a ladder recovered from the journal with the open orders at IB, without downloading
+    # history or placing the ladder again. Limit orders filled while the bot was down move the TP
+    # as the order status handler would have done. Return the arguments to resume the monitoring,
+    # None if the ladder is over, MANUAL_REVIEW if the state of one of its orders is unknown.
+    pair = config["pair"]
+    if ladder["tp_orderId"] is None:
+        print_strings(f"Ladder of {pair} was interrupted before its take profit was placed, check the position manually")
+        journal.record("ladder_closed", pair, reason="incomplete")
+        return None
+
+    open_trades = {trade.order.orderId: trade for trade in ib.openTrades()}
+    trades = {trade.order.orderId: trade for trade in ib.trades()}
+    filled_orders = {fill.execution.orderId for fill in ib.fills()}
+    outcomes = {orderId: order_outcome(orderId, open_trades, trades, filled_orders) for orderId in ladder["limit_orderIds"] + [ladder["tp_orderId"]]}
+
+    # Guessing would size the TP and the drawdown for the wrong position: leave the ladder in the journal
+    unknown = [orderId for orderId, outcome in outcomes.items() if outcome is None]
+    if unknown:
+        log.warning("Ladder of %s needs a manual review: state of orders %s unknown to IB", pair, unknown)
+        journal.record("manual_review", pair, orderIds=unknown)
+        return MANUAL_REVIEW
+
+    filled_count = ladder["filled_limit_orders_count"]
+    limit_trades = []
+    for orderId in ladder["limit_orderIds"]:
+        if outcomes[orderId] == "open":
+            limit_trades.append(open_trades[orderId])
+        elif outcomes[orderId] == "filled":
+            filled_count += 1
+            journal.record("limit_fill", pair, orderId=orderId, count=filled_count)
+            print_strings(f"Limit order {orderId} filled while the bot was down")
+        else:
+            print_strings(f"Limit order {orderId} was cancelled, removed from the ladder")
+
+    tp = open_trades.get(ladder["tp_orderId"])
+    if outcomes[ladder["tp_orderId"]] == "filled":
+        print_strings(f"Take profit of {pair} filled while the bot was down, cancelling the limit orders")
+        for trade in limit_trades:
+            ib.cancelOrder(trade.order)
+        journal.record("ladder_closed", pair, reason="take_profit")
+        return None
+
+    if tp is None or filled_count != ladder["filled_limit_orders_count"]:
+        # The TP is missing or does not cover the limit orders filled while the bot was down
+        if filled_count:
+            tp_size, tp_price = ladder["sizes_tp"][filled_count]['tp_size'], ladder["sizes_tp"][filled_count]['tp_price']
+        else:
+            tp_size, tp_price = ladder["tp_size"], ladder["tp_price"]
+        if tp is not None:
+            # Modify the TP in place, like the order status handler
+            tp.order.totalQuantity, tp.order.lmtPrice = tp_size, tp_price
+            ib.placeOrder(contract, tp.order)
+            print_strings(f"TP order {tp.order.orderId} modified: SIZE {tp_size} PRICE {tp_price}")
+        else:
+            tp = ib.placeOrder(contract, LimitOrder(ladder["tp_type"], tp_size, tp_price))
+            print_strings(f"New TP order placed: SIZE {tp_size} PRICE {tp_price}")
+        journal.record("tp_replaced", pair, old_orderId=ladder["tp_orderId"], orderId=tp.order.orderId, size=tp_size, price=tp_price)
+
+    print_strings(f"Ladder of {pair} recovered: {filled_count} limit orders filled, {len(limit_trades)} open")
+    return {
+        "order_info": {"type": ladder["side"]},
+        "tp_type": ladder["tp_type"],
+        "sizes_tp": ladder["sizes_tp"],
+        "tp_trade": [tp],
+        "limit_trades": limit_trades,
+        "net_liquidation": ladder["net_liquidation"], # Drawdown measured from the ladder opening
+        "filled_count": filled_count,
+    }
 
 def plot_indicators(SMA5_series, SMA25_series, RSI_series, myData, Bollinger_H_series, Bollinger_L_series):
     import matplotlib.pyplot as plt
@@ -507,18 +870,85 @@ def plot_indicators(SMA5_series, SMA25_series, RSI_series, myData, Bollinger_H_s
 
 
 
-welcome()
-
-myAccount, ib, home_currency, initial_funds, net_liquidation = boot_IB()
-config = get_config()
-contract = get_contract(config)
-if check_parameters(contract, home_currency, ib, initial_funds,config):
-    detect_trigger(config,ib,contract, net_liquidation)
-    print_strings("All orders filled, closing connection...")
-    input("Press enter to close the connection...")
+def run_bot(config, ib, home_currency, initial_funds, net_liquidation, daemon=False):
+    # Check the configuration of every pair and start trading.
+    # Return True once trading is over, None if the parameters are not safe.
+    # Ladders recovered from the journal are resumed either way, the check only gates new entries.
+    logger.configure(config.get("Log_level"))
+    metrics.configure(config.get("Metrics_file"))
+    pair_configs = get_pair_configs(config)
+    contracts = [get_contract(pair_config) for pair_config in pair_configs]
+
+    # Ladders left open by a previous run are resumed before looking for new signals
+    ladders = journal.configure(config.get("Journal_file"))
+    recovered = {}
+    review = [] # Pairs whose ladder can not be recovered safely
+    for pair_config, contract in zip(pair_configs, contracts):
+        if pair_config["pair"] in ladders:
+            ladder = recover_ladder(ib, pair_config, contract, ladders[pair_config["pair"]])
+            if ladder is MANUAL_REVIEW:
+                review.append(pair_config["pair"])
+            elif ladder is not None: # None when the ladder was over, nothing to resume
+                recovered[pair_config["pair"]] = ladder
+    if review:
+        print_strings(f"Ladders of {', '.join(review)} need a manual review, no new entries until they are removed from the journal")
+
+    # No prompt while open ladders wait to be resumed, an unsafe configuration is only logged.
+    safe = not review and all(check_parameters(contract, home_currency, ib, initial_funds, pair_config, daemon or bool(recovered)) for contract, pair_config in zip(contracts, pair_configs))
+
+    if len(pair_configs) == 1:
+        ladder = recovered.get(pair_configs[0]["pair"])
+        if ladder is not None:
+            if monitor_and_check_orders(ib, contracts[0], config=pair_configs[0], **ladder):
+                return True # The recovered ladder hit a drawdown
+        if not safe:
+            return None
+        if ladder is not None and pair_configs[0]["monitor_forever"].lower() == "false":
+            return True
+        detect_trigger(pair_configs[0],ib,contracts[0], net_liquidation)
+    else:
+        if safe or recovered:
+            run_pairs(pair_configs, contracts, ib, net_liquidation, recovered, new_entries=safe)
+        if not safe:
+            return None
+    return True
+
+
+def main(argv=None):
+    # Command line entry point. Return the process exit code.
+    parser = argparse.ArgumentParser(description="404 Profit Not Found trading bot.")
+    parser.add_argument("--config", default="config.json", help="configuration file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a configuration setting")
+    parser.add_argument("--daemon", action="store_true", help="no banner and no prompts, for running under a supervisor")
+    parser.add_argument("--host", help="IB Gateway host (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="IB Gateway port (default 7497)")
+    parser.add_argument("--client-id", type=int, help="IB client id (default 1)")
+    args = parser.parse_args(argv)
+
+    if not args.daemon:
+        welcome()
+
+    config = get_config(args.config, settings.parse_overrides(args.set))
+    if config is None:
+        return 1
+    boot = boot_IB(host=args.host, port=args.port, clientId=args.client_id)
+    if not boot or boot[1] is None:
+        return 1
+    myAccount, ib, home_currency, initial_funds, net_liquidation = boot
+    if run_bot(config, ib, home_currency, initial_funds, net_liquidation, args.daemon):
+        print_strings("All orders filled, closing connection...")
+        if not args.daemon:
+            logger.flush()
+            input("Press enter to close the connection...")
+        ib.disconnect()
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
 
 
 #Uncomment this to plot the indicators after the contract <3
 #SMA5_series, SMA25_series, RSI_series, Bollinger_H_series, Bollinger_L_series, myData, contract = get_parameters(ib,config,contract)
-#plot_indicators(SMA5_series, SMA25_series, RSI_series, myData, Bollinger_H_series, Bollinger_L_series)
-
+#plot_indicators(SMA5_series, SMA25_series, RSI_series, myData, Bollinger_H_series, Bollinger_L_series)
\ No newline at end of file
@@ -0,0 +1,105 @@
+import atexit
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Latency histograms of the live trading loop (historical download, indicators, order round trips).
+# Observations are kept in memory and written to the file set by configure, as JSON or, when the
+# file name ends with .prom, in the Prometheus text format (node_exporter textfile collector).
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Minimum time between two writes of the metrics file, in seconds.
+FLUSH_INTERVAL = 5
+
+_histograms = {}
+_export = {"path": None, "last_flush": 0.0, "at_exit": False}
+
+
+class Histogram:
+    __slots__ = ("name", "labels", "counts", "count", "sum")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * (len(BUCKETS) + 1) # Last bucket is +Inf.
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        # Bucket counts as Prometheus expects them: observations <= each upper bound.
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+def configure(path):
+    # Set the metrics file (None or "" disables the export). The file is written again at exit.
+    _export["path"] = path or None
+    if _export["path"] and not _export["at_exit"]:
+        atexit.register(flush) # Once, flush writes the file configured last
+        _export["at_exit"] = True
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram(name, dict(labels))
+    histogram.observe(seconds)
+    if _export["path"] and time.monotonic() - _export["last_flush"] >= FLUSH_INTERVAL:
+        flush()
+
+@contextmanager
+def span(name, **labels):
+    # Time the enclosed block and record it in the name histogram, also when it raises.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def reset():
+    _histograms.clear()
+
+def to_dict():
+    return {
+        "buckets": BUCKETS,
+        "histograms": [
+            {"name": h.name, "labels": h.labels, "count": h.count, "sum": h.sum, "counts": h.counts}
+            for h in _histograms.values()
+        ],
+    }
+
+def to_prometheus():
+    lines = []
+    for name in sorted({h.name for h in _histograms.values()}):
+        metric = f"trading_bot_{name}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for h in (h for h in _histograms.values() if h.name == name):
+            labels = "".join(f'{k}="{v}",' for k, v in sorted(h.labels.items()))
+            for bound, total in zip(BUCKETS + ["+Inf"], h.cumulative()):
+                lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {total}')
+            lines.append(f"{metric}_sum{{{labels.rstrip(',')}}} {h.sum}")
+            lines.append(f"{metric}_count{{{labels.rstrip(',')}}} {h.count}")
+    return "\n".join(lines) + "\n"
+
+def flush():
+    # Write the metrics file. The file is replaced atomically so readers never see it half written.
+    path = _export["path"]
+    if not path:
+        return
+    _export["last_flush"] = time.monotonic()
+    content = to_prometheus() if path.endswith(".prom") else json.dumps(to_dict(), indent=4)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
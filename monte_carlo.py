@@ -0,0 +1,203 @@
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from backtest import print_strings, boot_IB, get_config, get_contract, get_data
+from fibonacci import ladder_prices, ladder_templates, ladder_values
+import logger
+import settings
+
+# Monte Carlo stress test of the Martingale ladder: a market order is opened at the start of
+# thousands of price paths (bootstrapped from the historical returns or geometric Brownian motion),
+# the fibonacci orders and the take profit are placed as send_limit_orders/fibonacci_order do,
+# and every path is followed until the take profit fills, Max_drawdown is hit or the horizon ends.
+# All the paths are simulated at once: each step is a handful of array operations over the path axis.
+
+# Bars simulated per batch, so memory stays bounded for long horizons.
+CHUNK_BARS = 1000
+
+
+def log_returns(historical_data):
+    closes = historical_data["close"].to_numpy(dtype=np.float64)
+    return np.diff(np.log(closes))
+
+def bootstrap_paths(returns, n_paths, n_bars, start_price, rng, block_size=50):
+    # Price paths made of random blocks of consecutive historical returns (keeps volatility clusters).
+    # Yield the paths in chunks of CHUNK_BARS bars, shape (n_paths, bars of the chunk).
+    block_size = min(block_size, len(returns))
+    last = np.full(n_paths, np.log(start_price))
+    for chunk_start in range(0, n_bars, CHUNK_BARS):
+        chunk = min(CHUNK_BARS, n_bars - chunk_start)
+        n_blocks = -(-chunk // block_size)
+        starts = rng.integers(0, len(returns) - block_size + 1, size=(n_paths, n_blocks))
+        indices = (starts[:, :, None] + np.arange(block_size)).reshape(n_paths, -1)[:, :chunk]
+        log_prices = last[:, None] + np.cumsum(returns[indices], axis=1)
+        last = log_prices[:, -1]
+        yield np.exp(log_prices)
+
+def gbm_paths(sigma, n_paths, n_bars, start_price, rng, mu=0.0):
+    # Geometric Brownian motion paths with per bar drift mu and volatility sigma, in chunks.
+    last = np.full(n_paths, np.log(start_price))
+    for chunk_start in range(0, n_bars, CHUNK_BARS):
+        chunk = min(CHUNK_BARS, n_bars - chunk_start)
+        steps = rng.normal(mu - sigma**2 / 2, sigma, size=(n_paths, chunk))
+        log_prices = last[:, None] + np.cumsum(steps, axis=1)
+        last = log_prices[:, -1]
+        yield np.exp(log_prices)
+
+def build_ladders(config, entry, fibonacci_range, sign):
+    # Fibonacci prices, cumulative sizes/values and take profits of every path, shape (n_paths, depth).
+    # sign is +1 for BUY entries and -1 for SELL entries (levels below/above the entry).
+    # The ladders come from the fibonacci template, with the sizes and rounding of the live bot.
+    template = ladder_templates(fibonacci_range, sign, config)
+    prices, tp_prices = ladder_prices(template, entry)
+    cumulative_sizes = np.concatenate(([template["size"]], template["cumulative_sizes"]))
+    cumulative_values = ladder_values(template, entry, prices)
+    # Take profit once 0..depth levels are filled: the market order alone, then the template ones.
+    tp_prices = np.concatenate((np.round(entry[:, None] * template["tp_factor"], 4), tp_prices), axis=1)
+    return prices, cumulative_sizes, cumulative_values, tp_prices
+
+def simulate(config, paths, n_paths, sides, cash=100000):
+    # Run the ladder on the paths (iterator of price chunks). The first Fibonacci_duration bars
+    # are the history used for the fibonacci levels, the market order fills at the close of the last one.
+    # Return per path: max drawdown (fraction of cash), bars to take profit (nan if never), ruin flag, levels filled.
+    warmup = config["Fibonacci_duration"]
+    sign = np.where(sides == "BUY", 1.0, -1.0)
+    rows = np.arange(n_paths)
+    max_loss = config["Max_drawdown"] * cash
+
+    cursor = np.zeros(n_paths, dtype=np.int64) # Levels filled.
+    done = np.zeros(n_paths, dtype=bool)
+    ruined = np.zeros(n_paths, dtype=bool)
+    time_to_tp = np.full(n_paths, np.nan)
+    worst_pnl = np.zeros(n_paths)
+    ladders = None
+    history = []
+    bar = 0
+
+    for chunk in paths:
+        if ladders is None:
+            # Complete the history needed for the fibonacci range, then open the position.
+            history.append(chunk)
+            warm = np.concatenate(history, axis=1)
+            if warm.shape[1] < warmup:
+                continue
+            entry = warm[:, warmup - 1]
+            fibonacci_range = warm[:, :warmup].max(axis=1) - warm[:, :warmup].min(axis=1)
+            ladders = build_ladders(config, entry, fibonacci_range, sign)
+            prices, cumulative_sizes, cumulative_values, tp_prices = ladders
+            depth = prices.shape[1]
+            chunk = warm[:, warmup:]
+            bar = 0
+
+        for close in chunk.T:
+            active = ~done
+            # Fill the crossed fibonacci levels (several can fill on the same bar).
+            for _ in range(depth):
+                level = np.minimum(cursor, depth - 1)
+                fill = active & (cursor < depth) & (sign * close <= sign * prices[rows, level])
+                if not fill.any():
+                    break
+                cursor += fill
+
+            # Open position PnL, and stop-out once the loss reaches Max_drawdown (like the live monitor).
+            pnl = sign * (close * cumulative_sizes[cursor] - cumulative_values[rows, cursor])
+            worst_pnl = np.where(active, np.minimum(worst_pnl, pnl), worst_pnl)
+            stop = active & (pnl <= -max_loss)
+            ruined |= stop
+
+            take_profit = active & ~stop & (sign * close >= sign * tp_prices[rows, cursor])
+            time_to_tp[take_profit] = bar + 1 # Bars after the entry, 1 for the first bar
+            done |= stop | take_profit
+            bar += 1
+            if done.all():
+                break
+        if ladders is not None and done.all():
+            break
+
+    return {
+        "side": sides,
+        "max_drawdown": -worst_pnl / cash,
+        "time_to_tp": time_to_tp,
+        "ruined": ruined,
+        "levels_filled": cursor,
+    }
+
+def run_monte_carlo(config, historical_data, n_paths=10000, n_bars=5000, method="bootstrap", side="random", cash=100000, seed=None):
+    # Simulate the ladder on n_paths paths of n_bars bars starting from the last historical close.
+    # Return the per path results (DataFrame) and the summary of the distributions.
+    rng = np.random.default_rng(seed)
+    returns = log_returns(historical_data)
+    start_price = historical_data["close"].iloc[-1]
+    total_bars = n_bars + config["Fibonacci_duration"]
+    if method == "bootstrap":
+        paths = bootstrap_paths(returns, n_paths, total_bars, start_price, rng)
+    else:
+        paths = gbm_paths(returns.std(), n_paths, total_bars, start_price, rng)
+    if side == "random":
+        sides = np.where(rng.random(n_paths) < 0.5, "BUY", "SELL")
+    else:
+        sides = np.full(n_paths, side)
+
+    print_strings(f"Simulating {n_paths} {method} paths of {n_bars} bars...")
+    results = pd.DataFrame(simulate(config, paths, n_paths, sides, cash))
+    return results, summarize(results)
+
+def summarize(results):
+    # Distribution summary: ruin probability, max drawdown and time to take profit percentiles.
+    percentiles = [50, 90, 95, 99]
+    time_to_tp = results["time_to_tp"].dropna()
+    summary = {
+        "paths": len(results),
+        "ruin_probability": float(results["ruined"].mean()),
+        "tp_probability": len(time_to_tp) / len(results),
+        "open_at_horizon": float((~results["ruined"] & results["time_to_tp"].isna()).mean()),
+    }
+    for p in percentiles:
+        summary[f"max_drawdown_p{p}"] = float(np.percentile(results["max_drawdown"], p))
+    for p in percentiles:
+        summary[f"time_to_tp_p{p}"] = float(np.percentile(time_to_tp, p)) if len(time_to_tp) else np.nan
+    for levels, count in results["levels_filled"].value_counts().sort_index().items():
+        summary[f"levels_filled_{levels}"] = count / len(results)
+    return summary
+
+
+def main(argv=None):
+    # Command line entry point. Return the process exit code.
+    parser = argparse.ArgumentParser(description="Monte Carlo stress test of the Martingale ladder.")
+    parser.add_argument("--config", default="config.json", help="configuration file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a configuration setting")
+    parser.add_argument("--paths", type=int, default=10000)
+    parser.add_argument("--bars", type=int, default=5000, help="horizon of each path in bars")
+    parser.add_argument("--method", choices=["bootstrap", "gbm"], default="bootstrap")
+    parser.add_argument("--side", choices=["random", "BUY", "SELL"], default="random")
+    parser.add_argument("--cash", type=float, default=100000, help="account size Max_drawdown applies to")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--host", help="IB Gateway host (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="IB Gateway port (default 7497)")
+    parser.add_argument("--client-id", type=int, help="IB client id (default 1)")
+    args = parser.parse_args(argv)
+
+    config = get_config(args.config, settings.parse_overrides(args.set)) # Read configuration parameters from config.json.
+    if config is None:
+        return 1
+    logger.configure(config.get("Log_level"))
+    myAccount, ib = boot_IB(args.host, args.port, args.client_id) # Get IB gateaway established.
+    if ib is None:
+        return 1
+    contract = get_contract(config)
+    if contract is None:
+        return 1
+    historical_data = get_data(config, ib, contract)
+    ib.disconnect()
+    if historical_data is None:
+        return 1
+    results, summary = run_monte_carlo(config, historical_data, args.paths, args.bars, args.method, args.side, args.cash, args.seed)
+    results.to_csv('monte_carlo_results.csv', index=False)
+    for name, value in summary.items():
+        print_strings(f"{name}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
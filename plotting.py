@@ -0,0 +1,100 @@
+import numpy as np
+from trade_log import POSITIONS
+
+# Plot of a backtest that stays responsive for million-bar runs: the price series is downsampled
+# with LTTB (largest triangle three buckets, keeps the visual shape: peaks, troughs and trends),
+# every trace is a WebGL Scattergl and the figure is written to a self-contained HTML file.
+
+# Points kept from the price series, far more than a screen can show.
+MAX_POINTS = 5000
+
+# Marker of every trade type of the trade log: color, symbol and size.
+MARKERS = {
+    "MKT_BUY": ("lime", "triangle-up", 12),
+    "MKT_SELL": ("firebrick", "triangle-down", 12),
+    "TP_BUY": ("orange", "circle", 10),
+    "TP_SELL": ("darkorange", "x", 10),
+    "FIBO_BUY": ("deepskyblue", "diamond", 12),
+    "FIBO_SELL": ("darkred", "diamond", 12),
+    "STOP_BUY": ("black", "square", 12),
+    "STOP_SELL": ("black", "square", 12),
+    "CLOSE_BUY": ("gray", "square-open", 12),
+    "CLOSE_SELL": ("gray", "square-open", 12),
+}
+
+
+def lttb(x, y, threshold=MAX_POINTS):
+    # Indices of the threshold points of (x, y) selected by LTTB, all of them if there are fewer.
+    # The first and last points are kept, every bucket in between keeps the point making the
+    # largest triangle with the point kept in the previous bucket and the mean of the next bucket.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    # Means of every bucket (the last one is the last point alone), used for the next-bucket corner.
+    starts = edges[1:]
+    counts = np.diff(np.append(starts, n))
+    mean_x = np.add.reduceat(x, starts) / counts
+    mean_y = np.add.reduceat(y, starts) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        area = np.abs((x[a] - mean_x[bucket]) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (mean_y[bucket] - y[a]))
+        a = start + int(area.argmax())
+        selected[bucket + 1] = a
+    return selected
+
+def trade_markers(trade_log):
+    # Steps and prices of the trades grouped by trade type: {position: (steps, prices)}.
+    steps, codes, prices, _, _ = trade_log.columns()
+    return {POSITIONS[code]: (steps[codes == code], prices[codes == code]) for code in np.unique(codes)}
+
+def plot_trades(historical_data, trade_log, path="backtest_plot.html", max_points=MAX_POINTS):
+    # Write the price series with the trades of the backtest to path (HTML with plotly.js inlined,
+    # opens offline in any browser). Return path.
+    import plotly.graph_objects as go # Only needed for plotting, not imported by the sweep and the other tools
+    closes = historical_data["close"].to_numpy(dtype=np.float64)
+    steps = np.arange(len(closes))
+    kept = lttb(steps.astype(np.float64), closes, max_points)
+
+    fig = go.Figure()
+    # Add the price line (the historical price series, downsampled)
+    fig.add_trace(go.Scattergl(
+        x=steps[kept],
+        y=closes[kept],
+        mode='lines',
+        name='Price' if len(kept) == len(closes) else f'Price ({len(kept)} of {len(closes)} bars)',
+        line=dict(color='blue', width=2),
+        hoverinfo='x+y'
+    ))
+
+    # One trace per trade type, all the trades are drawn
+    markers = trade_markers(trade_log)
+    for position, (color, symbol, size) in MARKERS.items():
+        if position not in markers:
+            continue
+        trade_steps, trade_prices = markers[position]
+        fig.add_trace(go.Scattergl(
+            x=trade_steps,
+            y=trade_prices,
+            mode='markers',
+            marker=dict(color=color, symbol=symbol, size=size, line=dict(width=2, color='black')),
+            name=position,
+            hoverinfo='x+y'
+        ))
+
+    fig.update_layout(
+        title='Price Series with Buy/Sell Points',
+        xaxis_title='Time (Steps)',
+        yaxis_title='Price',
+        legend_title='Trade Type',
+        template='plotly_white',
+        hovermode='x unified',
+        margin=dict(l=40, r=40, t=40, b=40),
+    )
+    fig.write_html(path, include_plotlyjs=True, full_html=True)
+    return path
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+# Local resampling of fine bars into coarser ones (e.g. "5 mins" bars into "10 mins" or "1 hour"),
+# so several timeframes can be derived from one download or one live subscription.
+# Coarse bars are aligned on multiples of their size since the epoch (UTC), like the IB intraday bars.
+
+
+def to_epoch(dates):
+    # Bar dates (datetime64, aware or not, or epoch seconds) as int64 epoch seconds.
+    if np.issubdtype(np.asarray(dates).dtype, np.integer):
+        return np.asarray(dates, dtype=np.int64)
+    return ((pd.to_datetime(dates, utc=True) - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+
+def weighted_average(value_volume, volume, value_count, count, value_sum, bars):
+    # Average price of coarse bars from the sums over their base bars: weighted by volume, by barCount
+    # when there is no volume (e.g. some CASH bars), plain mean when neither is reported (-1 on MIDPOINT bars).
+    # Works on scalars (Resampler) and on arrays of coarse bars (resample).
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(volume > 0, value_volume / volume, np.where(count > 0, value_count / count, value_sum / bars))
+
+def resample(historical_data, bar_seconds):
+    # Resample a DataFrame of bars (date, open, high, low, close and optionally volume, average,
+    # barCount) into bars of bar_seconds. Vectorized: one reduceat per column.
+    if historical_data.empty:
+        return historical_data.copy()
+    dates = to_epoch(historical_data["date"])
+    buckets = dates // bar_seconds * bar_seconds
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.concatenate((starts[1:], [len(buckets)])) - 1
+
+    resampled = {
+        "date": pd.to_datetime(buckets[starts], unit="s", utc=True),
+        "open": historical_data["open"].to_numpy()[starts],
+        "high": np.maximum.reduceat(historical_data["high"].to_numpy(), starts),
+        "low": np.minimum.reduceat(historical_data["low"].to_numpy(), starts),
+        "close": historical_data["close"].to_numpy()[ends],
+    }
+    if "volume" in historical_data:
+        resampled["volume"] = np.add.reduceat(historical_data["volume"].to_numpy(), starts)
+    if "average" in historical_data:
+        average = historical_data["average"].to_numpy(dtype=np.float64)
+        # Missing volumes and bar counts (-1) weigh nothing.
+        volume = np.maximum(historical_data["volume"].to_numpy(dtype=np.float64), 0) if "volume" in historical_data else np.zeros(len(average))
+        count = np.maximum(historical_data["barCount"].to_numpy(dtype=np.float64), 0) if "barCount" in historical_data else np.zeros(len(average))
+        resampled["average"] = weighted_average(
+            np.add.reduceat(average * volume, starts), np.add.reduceat(volume, starts),
+            np.add.reduceat(average * count, starts), np.add.reduceat(count, starts),
+            np.add.reduceat(average, starts), ends - starts + 1)
+    if "barCount" in historical_data:
+        resampled["barCount"] = np.add.reduceat(historical_data["barCount"].to_numpy(), starts)
+    return pd.DataFrame(resampled)
+
+
+class Resampler:
+    # Incremental resampler for live bars: feed the completed base bars one at a time (O(1) each),
+    # a coarse bar is returned as soon as it is complete.
+    __slots__ = ("bar_seconds", "base_seconds", "bucket", "open", "high", "low", "close", "volume", "barCount", "sums")
+
+    def __init__(self, bar_seconds, base_seconds):
+        self.bar_seconds = bar_seconds
+        self.base_seconds = base_seconds
+        self.bucket = None # Start of the coarse bar being built.
+        self.open = self.high = self.low = self.close = self.volume = self.barCount = None
+        self.sums = None # Sums of weighted_average over the base bars.
+
+    def update(self, date, open, high, low, close, volume=0.0, average=0.0, barCount=0):
+        # Add a completed base bar starting at date (epoch seconds).
+        # Return the list of coarse bars completed by it (usually empty or one bar).
+        completed = []
+        bucket = date // self.bar_seconds * self.bar_seconds
+        if self.bucket is not None and bucket != self.bucket:
+            # The previous coarse bar missed its last base bars (gap in the data), close it as is.
+            completed.append(self.current())
+            self.bucket = None
+        if self.bucket is None:
+            self.bucket = bucket
+            self.open, self.high, self.low, self.volume, self.barCount = open, high, low, 0.0, 0
+            self.sums = [0.0, 0.0, 0.0, 0.0, 0.0, 0]
+        self.high = max(self.high, high)
+        self.low = min(self.low, low)
+        self.close = close
+        self.volume += volume
+        self.barCount += barCount
+        weight, count = max(volume, 0.0), max(barCount, 0) # Missing volumes and bar counts (-1) weigh nothing.
+        sums = self.sums
+        sums[0] += average * weight
+        sums[1] += weight
+        sums[2] += average * count
+        sums[3] += count
+        sums[4] += average
+        sums[5] += 1
+        if date + self.base_seconds >= bucket + self.bar_seconds:
+            # Last base bar of the coarse bar.
+            completed.append(self.current())
+            self.bucket = None
+        return completed
+
+    def current(self):
+        # Coarse bar being built (date, open, high, low, close, volume, average, barCount).
+        return (self.bucket, self.open, self.high, self.low, self.close, self.volume, float(weighted_average(*np.array(self.sums, dtype=np.float64))), self.barCount)
+
+
+def timeframes(base_data, bar_sizes):
+    # Resample the base bars into every bar size of bar_sizes (seconds).
+    # Return a dict bar size -> DataFrame.
+    return {bar_seconds: resample(base_data, bar_seconds) for bar_seconds in bar_sizes}
@@ -0,0 +1,57 @@
+import json
+import os
+
+# Configuration loading shared by the command line entry points: config.json, then environment
+# variables, then --set arguments, each one overriding the previous.
+#   TRADING_BOT_pair=EURUSD python main.py --daemon
+#   python main.py --daemon --config live.json --set Take_profit=0.01 --set Streaming_bars=True
+
+ENV_PREFIX = "TRADING_BOT_"
+
+# Connection settings of the IB Gateway, read from the environment when not given as arguments.
+IB_DEFAULTS = {"host": "127.0.0.1", "port": 7497, "client_id": 1}
+
+
+def parse_value(value):
+    # Values are read as JSON when possible (numbers, lists) and kept as strings otherwise,
+    # so "True"/"False" stay strings like in config.json.
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def parse_overrides(assignments):
+    # ["Take_profit=0.01", "pair=EURUSD"] -> {"Take_profit": 0.01, "pair": "EURUSD"}
+    overrides = {}
+    for assignment in assignments or []:
+        key, separator, value = assignment.partition("=")
+        if not separator:
+            raise ValueError(f"Expected KEY=VALUE, got {assignment}")
+        overrides[key.strip()] = parse_value(value)
+    return overrides
+
+def env_overrides(config, environ=None):
+    # TRADING_BOT_<key> variables matching a config key (case insensitive).
+    environ = os.environ if environ is None else environ
+    keys = {key.lower(): key for key in config}
+    overrides = {}
+    for name, value in environ.items():
+        if name.startswith(ENV_PREFIX) and name[len(ENV_PREFIX):].lower() in keys:
+            overrides[keys[name[len(ENV_PREFIX):].lower()]] = parse_value(value)
+    return overrides
+
+def load_config(path="config.json", overrides=None, environ=None):
+    with open(path) as f:
+        config = json.load(f)
+    config.update(env_overrides(config, environ))
+    config.update(overrides or {})
+    return config
+
+def ib_connection(host=None, port=None, client_id=None, environ=None):
+    # IB Gateway host, port and client id: arguments, then TRADING_BOT_IB_HOST/PORT/CLIENT_ID, then defaults.
+    environ = os.environ if environ is None else environ
+    values = {"host": host, "port": port, "client_id": client_id}
+    for name, default in IB_DEFAULTS.items():
+        if values[name] is None:
+            values[name] = type(default)(environ.get(f"{ENV_PREFIX}IB_{name.upper()}", default))
+    return values["host"], values["port"], values["client_id"]
@@ -0,0 +1,461 @@
+import asyncio
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from ib_insync import (
+    AccountValue, BarData, BarDataList, Event, Execution, Fill, OrderStatus, PnL, RequestError, Ticker, Trade, TradeLogEntry)
+from bar_cache import parse_duration
+import logger
+
+# In-process stand-in for the IB Gateway. It implements the IB methods and events used by main.py,
+# replaying recorded or synthetic bars on a simulated clock with deterministic fills:
+#  - market orders fill at the current close the next time the clock runs (sleep/waitOnUpdate),
+#  - limit orders fill at their limit price once a later bar closes through it
+#    (or touches it with its high/low when intrabar=True).
+# The clock only moves when the bot waits (ib.sleep, ib.waitOnUpdate), at least one bar at a
+# time, so a whole session runs as fast as the order-management code allows.
+# It also serves as a local historical data server for backfill.py: requests honour endDateTime,
+# can take some latency and are refused past a pacing limit like IB does.
+
+
+class SimulationEnd(Exception):
+    # Raised when the bot waits past the last simulated bar.
+    pass
+
+
+class SimIB:
+    # Like IB.RaiseRequestErrors: raise RequestError for failed historical data requests instead of returning no bars.
+    RaiseRequestErrors = False
+
+    def __init__(self, bars_by_pair, cash=100000.0, currency="USD", start=0, intrabar=False, history_latency=0.0, history_pacing=None):
+        # bars_by_pair: {"USDCHF": DataFrame with date, open, high, low, close}.
+        # start: index of the first current bar in the first pair's data (bars before it are history).
+        # history_latency: seconds taken by every historical data request (asynchronous requests only).
+        # history_pacing: (requests, seconds), historical data requests beyond this rate fail with a pacing violation.
+        self.account = "SIM"
+        self.currency = currency
+        self.intrabar = intrabar
+        self.data = {}
+        for pair, bars in bars_by_pair.items():
+            self.data[pair] = {
+                "date": ((pd.to_datetime(bars["date"], utc=True) - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64),
+                "open": bars["open"].to_numpy(dtype=float),
+                "high": bars["high"].to_numpy(dtype=float),
+                "low": bars["low"].to_numpy(dtype=float),
+                "close": bars["close"].to_numpy(dtype=float),
+            }
+        first = next(iter(self.data.values()))
+        self.now = int(first["date"][start])
+        self.cursor = {pair: self._bar_index(pair) for pair in self.data}
+
+        self.cash = {currency: float(cash)}
+        self.positions = {pair: 0.0 for pair in self.data}
+        self.initial_liquidation = float(cash)
+
+        self.next_order_id = 1
+        self.next_exec_id = 1
+        self.placed = [] # Every trade placed, in order
+        self.tickers = {}
+        self.subscriptions = [] # keepUpToDate bar lists
+        self.history_latency = history_latency
+        self.history_pacing = history_pacing
+        self.history_requests = [] # Wall clock time of every historical data request
+        self.pacing_violations = 0
+        self.pnl_subscription = None # PnL object of the reqPnL subscription
+
+        self.accountSummaryEvent = Event("accountSummaryEvent")
+        self.accountValueEvent = Event("accountValueEvent")
+        self.pnlEvent = Event("pnlEvent")
+
+    # Connection
+
+    def connect(self, *args, **kwargs):
+        return self
+
+    def disconnect(self):
+        pass
+
+    def isConnected(self):
+        return True
+
+    def managedAccounts(self):
+        return [self.account]
+
+    # Clock
+
+    def sleep(self, seconds=0.02):
+        self._check_blocking("sleep")
+        # Pending market orders are filled first without moving the clock. Otherwise the clock moves
+        # forward by seconds, and at least up to the next bar since nothing can change in between.
+        if self._process_market_orders():
+            return True
+        next_date = self._next_date()
+        if next_date is None:
+            raise SimulationEnd()
+        self._advance(max(self.now + seconds, next_date))
+        return True
+
+    def waitOnUpdate(self, timeout=0):
+        self._check_blocking("waitOnUpdate")
+        # Pending market orders are filled first (their fill is the update). Otherwise move the
+        # simulated clock to the next bar.
+        if self._process_market_orders():
+            return True
+        next_date = self._next_date()
+        if next_date is None:
+            raise SimulationEnd()
+        self._advance(next_date)
+        return True
+
+    def run(self, *awaitables, timeout=None):
+        # Run coroutines (multi-pair mode), the clock moves one bar each time they all wait.
+        async def main():
+            tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+            try:
+                while not all(task.done() for task in tasks):
+                    await asyncio.sleep(0)
+                    self._process_market_orders()
+                    next_date = self._next_date()
+                    if next_date is None:
+                        raise SimulationEnd()
+                    self._advance(next_date)
+                return [task.result() for task in tasks]
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return asyncio.run(main())
+
+    # Account
+
+    def accountSummary(self, account=''):
+        self._check_blocking("accountSummary")
+        return self._account_summary()
+
+    async def accountSummaryAsync(self, account=''):
+        return self._account_summary()
+
+    def _account_summary(self):
+        values = [AccountValue(self.account, "TotalCashBalance", str(amount), currency, "") for currency, amount in self.cash.items()]
+        values.append(AccountValue(self.account, "AvailableFunds", str(self.cash[self.currency]), self.currency, ""))
+        values.append(AccountValue(self.account, "NetLiquidation", str(self.net_liquidation()), self.currency, ""))
+        return values
+
+    def net_liquidation(self):
+        # Cash in every currency converted in the home currency with the current prices.
+        total = 0.0
+        for currency, amount in self.cash.items():
+            total += amount * self._rate(currency)
+        return total
+
+    def reqPnL(self, account, modelCode=''):
+        # Like ib_insync, one subscription per account and model.
+        assert self.pnl_subscription is None, f"Pnl request for {account} {modelCode} already made"
+        self.pnl_subscription = PnL(account=account, modelCode=modelCode, dailyPnL=0.0, unrealizedPnL=0.0, realizedPnL=0.0)
+        return self.pnl_subscription
+
+    def cancelPnL(self, account, modelCode=''):
+        self.pnl_subscription = None
+
+    def pnl(self, account='', modelCode=''):
+        # Subscribed PnL objects.
+        return [self.pnl_subscription] if self.pnl_subscription is not None else []
+
+    # Market data
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False, mktDataOptions=None):
+        ticker = Ticker(contract=contract)
+        self.tickers[contract.pair()] = ticker
+        self._update_ticker(contract.pair())
+        return ticker
+
+    def reqHistoricalData(self, contract, endDateTime='', durationStr='1 D', barSizeSetting='', whatToShow='MIDPOINT',
+                          useRTH=0, formatDate=1, keepUpToDate=False, chartOptions=None):
+        self._check_blocking("reqHistoricalData")
+        if not self._within_pacing():
+            return self._pacing_violation()
+        return self._historical_bars(contract, endDateTime, durationStr, keepUpToDate)
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime='', durationStr='1 D', barSizeSetting='', whatToShow='MIDPOINT',
+                                     useRTH=0, formatDate=1, keepUpToDate=False, chartOptions=None):
+        # Paced when received, the bars come back history_latency later.
+        if not self._within_pacing():
+            return self._pacing_violation()
+        if self.history_latency:
+            await asyncio.sleep(self.history_latency)
+        return self._historical_bars(contract, endDateTime, durationStr, keepUpToDate)
+
+    def cancelHistoricalData(self, bars):
+        if bars in self.subscriptions:
+            self.subscriptions.remove(bars)
+
+    # Orders
+
+    def placeOrder(self, contract, order):
+        # Place a new order, or modify the open order with the same orderId.
+        for trade in self.openTrades():
+            if order.orderId and trade.order.orderId == order.orderId:
+                trade.order = order
+                trade.log.append(TradeLogEntry(self._time(), trade.orderStatus.status, "Modify"))
+                trade.modifyEvent.emit(trade)
+                # Acknowledged at once, reported like ib_insync does for the order status of a modification
+                trade.log.append(TradeLogEntry(self._time(), trade.orderStatus.status, "Modified"))
+                trade.statusEvent.emit(trade)
+                return trade
+        order.orderId = self.next_order_id
+        self.next_order_id += 1
+        trade = Trade(contract=contract, order=order, orderStatus=OrderStatus(orderId=order.orderId, status="Submitted", remaining=order.totalQuantity))
+        trade.log.append(TradeLogEntry(self._time(), "Submitted"))
+        self.placed.append(trade)
+        return trade
+
+    def cancelOrder(self, order):
+        for trade in self.openTrades():
+            if trade.order.orderId == order.orderId:
+                trade.orderStatus.status = "Cancelled"
+                trade.log.append(TradeLogEntry(self._time(), "Cancelled"))
+                trade.statusEvent.emit(trade)
+                trade.cancelledEvent.emit(trade)
+                return trade
+
+    def fills(self):
+        return [fill for trade in self.placed for fill in trade.fills]
+
+    def trades(self):
+        return list(self.placed)
+
+    def openTrades(self):
+        return [trade for trade in self.placed if not trade.isDone()]
+
+    # Internals
+
+    def _check_blocking(self, method):
+        # The blocking IB methods run the event loop until their answer comes, which fails from a
+        # coroutine or handler already running on the loop: refuse them there like ib_insync does.
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        raise RuntimeError(f"This event loop is already running (blocking {method} called from the event loop)")
+
+    def _time(self):
+        return datetime.datetime.fromtimestamp(self.now, datetime.timezone.utc)
+
+    def _within_pacing(self):
+        # Record a historical data request, False if it goes past history_pacing.
+        now = time.monotonic()
+        if self.history_pacing is not None:
+            requests, seconds = self.history_pacing
+            if len(self.history_requests) >= requests and now - self.history_requests[-requests] < seconds:
+                return False
+        self.history_requests.append(now)
+        return True
+
+    def _pacing_violation(self):
+        # Refused like IB does (error 162).
+        self.pacing_violations += 1
+        if self.RaiseRequestErrors:
+            raise RequestError(len(self.history_requests), 162, "Historical Market Data Service error message:Historical data request pacing violation")
+        return BarDataList()
+
+    def _historical_bars(self, contract, endDateTime, durationStr, keepUpToDate):
+        # Bars of the durationStr window up to the current (still forming) bar, or with endDateTime
+        # the bars starting in the durationStr window before it (and not after the current bar).
+        reqId = len(self.history_requests) - 1
+        pair = contract.pair()
+        data = self.data[pair]
+        last = self.cursor[pair]
+        if endDateTime:
+            end = int(pd.Timestamp(endDateTime).timestamp())
+            last = min(last, int(np.searchsorted(data["date"], end, side="left")) - 1)
+        else:
+            end = data["date"][last]
+        first = np.searchsorted(data["date"], end - parse_duration(durationStr), side="left")
+        bars = BarDataList()
+        bars.reqId = reqId
+        bars.contract = contract
+        bars.keepUpToDate = keepUpToDate
+        for i in range(first, last + 1):
+            bars.append(self._bar(pair, i))
+        if not bars and self.RaiseRequestErrors:
+            raise RequestError(reqId, 162, "Historical Market Data Service error message:HMDS query returned no data")
+        if keepUpToDate:
+            self.subscriptions.append(bars)
+        return bars
+
+    def _bar_index(self, pair):
+        return max(int(np.searchsorted(self.data[pair]["date"], self.now, side="right")) - 1, 0)
+
+    def _bar(self, pair, i):
+        data = self.data[pair]
+        return BarData(date=datetime.datetime.fromtimestamp(int(data["date"][i]), datetime.timezone.utc),
+                       open=data["open"][i], high=data["high"][i], low=data["low"][i], close=data["close"][i],
+                       volume=-1, average=-1, barCount=-1)
+
+    def _next_date(self):
+        # Start of the next bar among all pairs, None at the end of the data.
+        dates = [data["date"][self.cursor[pair] + 1] for pair, data in self.data.items() if self.cursor[pair] + 1 < len(data["date"])]
+        return int(min(dates)) if dates else None
+
+    def _rate(self, currency):
+        # Value of one unit of currency in the home currency, from the current prices.
+        if currency == self.currency:
+            return 1.0
+        for pair in self.data:
+            price = self.data[pair]["close"][self.cursor[pair]]
+            if pair == self.currency + currency:
+                return 1 / price
+            if pair == currency + self.currency:
+                return price
+        return 0.0
+
+    def _update_ticker(self, pair):
+        ticker = self.tickers.get(pair)
+        if ticker is not None:
+            price = self.data[pair]["close"][self.cursor[pair]]
+            ticker.bid = ticker.ask = ticker.last = ticker.close = price
+            ticker.time = self._time()
+
+    def _advance(self, target):
+        self._process_market_orders()
+        while True:
+            next_date = self._next_date()
+            if next_date is None or next_date > target:
+                break
+            self.now = next_date
+            for pair in self.data:
+                new_index = self._bar_index(pair)
+                if new_index == self.cursor[pair]:
+                    continue
+                self.cursor[pair] = new_index
+                self._update_ticker(pair)
+                self._process_limit_orders(pair)
+                for bars in list(self.subscriptions):
+                    if bars.contract.pair() == pair:
+                        bars.append(self._bar(pair, new_index))
+                        bars.updateEvent.emit(bars, True)
+            self._emit_account()
+            self._process_market_orders() # Orders placed by the event handlers
+        self.now = max(self.now, int(target))
+
+    def _process_market_orders(self):
+        # Fill the open market orders at the current close, return True if any was filled.
+        filled = False
+        for trade in self.openTrades():
+            if trade.order.orderType == "MKT":
+                pair = trade.contract.pair()
+                self._fill(trade, self.data[pair]["close"][self.cursor[pair]])
+                filled = True
+        return filled
+
+    def _process_limit_orders(self, pair):
+        data = self.data[pair]
+        i = self.cursor[pair]
+        for trade in self.openTrades():
+            if trade.order.orderType != "LMT" or trade.contract.pair() != pair:
+                continue
+            limit = trade.order.lmtPrice
+            if trade.order.action == "BUY":
+                price = data["low"][i] if self.intrabar else data["close"][i]
+                if price <= limit:
+                    self._fill(trade, limit)
+            else:
+                price = data["high"][i] if self.intrabar else data["close"][i]
+                if price >= limit:
+                    self._fill(trade, limit)
+
+    def _fill(self, trade, price):
+        # Fill the whole order at price, updating cash and position.
+        pair = trade.contract.pair()
+        quantity = trade.order.totalQuantity
+        sign = 1 if trade.order.action == "BUY" else -1
+        base, quote = trade.contract.symbol, trade.contract.currency
+        self.positions[pair] += sign * quantity
+        self.cash[base] = self.cash.get(base, 0.0) + sign * quantity
+        self.cash[quote] = self.cash.get(quote, 0.0) - sign * quantity * price
+
+        execution = Execution(execId=str(self.next_exec_id), time=self._time(), acctNumber=self.account,
+                              side="BOT" if sign > 0 else "SLD", shares=quantity, price=float(price),
+                              orderId=trade.order.orderId, cumQty=quantity, avgPrice=float(price))
+        self.next_exec_id += 1
+        fill = Fill(trade.contract, execution, None, self._time())
+        trade.fills.append(fill)
+        trade.orderStatus.status = "Filled"
+        trade.orderStatus.filled = quantity
+        trade.orderStatus.remaining = 0
+        trade.orderStatus.avgFillPrice = float(price)
+        trade.orderStatus.lastFillPrice = float(price)
+        trade.log.append(TradeLogEntry(self._time(), "Filled"))
+        trade.fillEvent.emit(trade, fill)
+        trade.statusEvent.emit(trade)
+        trade.filledEvent.emit(trade)
+
+    def _emit_account(self):
+        net_liquidation = self.net_liquidation()
+        value = AccountValue(self.account, "NetLiquidation", str(net_liquidation), self.currency, "")
+        self.accountValueEvent.emit(value)
+        if self.pnl_subscription is not None:
+            self.pnl_subscription.dailyPnL = net_liquidation - self.initial_liquidation
+            self.pnlEvent.emit(self.pnl_subscription)
+
+
+def synthetic_bars(n, price=0.9, volatility=0.0008, barSizeSeconds=600, seed=0):
+    # Geometric random walk bars, deterministic for a given seed.
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    open_ = np.concatenate(([price], close[:-1]))
+    spread = np.abs(rng.normal(0, volatility / 2, n))
+    return pd.DataFrame({
+        "date": pd.date_range("2024-01-01", periods=n, freq=f"{barSizeSeconds}s", tz="UTC"),
+        "open": open_,
+        "high": np.maximum(open_, close) * (1 + spread),
+        "low": np.minimum(open_, close) * (1 - spread),
+        "close": close,
+    })
+
+def offline_config(config):
+    # Config of a simulated run: journal and metrics go to a temporary directory. The live journal
+    # holds the recovery state of the real open ladders, a simulation must neither replay nor compact it.
+    directory = tempfile.mkdtemp()
+    metrics_name = os.path.basename(config.get("Metrics_file") or "") or "metrics.json"
+    return dict(config, Journal_file=os.path.join(directory, "journal.jsonl"), Metrics_file=os.path.join(directory, metrics_name))
+
+def run_simulation(config, bars_by_pair, cash=100000.0, currency="USD", intrabar=False):
+    # Run the live bot (main.py) end to end against the simulated broker.
+    # Trading starts once the longest indicator window is available. Return the SimIB instance.
+    import bar_cache
+    import main
+    bar_cache.CACHE_DIR = tempfile.mkdtemp() # Keep simulated bars out of the real cache
+    config = offline_config(config) # ... and simulated orders out of the real journal and metrics
+
+    start = max(config["SMA_big_duration"], config["RSI_duration"], config["bolinger_band_duration"]) + 1
+    ib = SimIB(bars_by_pair, cash=cash, currency=currency, start=start, intrabar=intrabar)
+    myAccount, ib, home_currency, initial_funds, net_liquidation = main.boot_IB(ib)
+    try:
+        main.run_bot(config, ib, home_currency, initial_funds, net_liquidation, daemon=True) # No terminal to prompt
+    except SimulationEnd:
+        main.print_strings("End of simulated data")
+    return ib
+
+
+if __name__ == "__main__":
+    # python sim_broker.py [bars.csv]: replay a CSV (date, open, high, low, close) or synthetic bars.
+    with open('config.json') as f:
+        config = json.load(f)
+    if len(sys.argv) > 1:
+        bars = pd.read_csv(sys.argv[1])
+    else:
+        bars = synthetic_bars(5000)
+    pairs = config.get("pairs", [config["pair"]])
+    bars_by_pair = {pair: bars for pair in pairs}
+
+    start_time = time.perf_counter()
+    ib = run_simulation(config, bars_by_pair)
+    elapsed = time.perf_counter() - start_time
+    logger.flush()
+    print(f"\n{len(ib.placed)} orders, {sum(len(t.fills) for t in ib.placed)} fills, "
+          f"net liquidation {ib.net_liquidation():.2f} {ib.currency}, {elapsed:.2f}s")
@@ -0,0 +1,184 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import logger
+from accounting import backtest_statistics
+from backtest import backtest_strategy, print_strings, boot_IB, get_config, get_contract, get_data
+from bar_cache import parse_bar_size
+from trade_log import concat
+import settings
+
+# Price columns shared with the worker processes, the backtest only needs these.
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+
+# Worker process state, set once per process by init_worker.
+_worker = {}
+
+
+def expand_grid(param_ranges):
+    # Expand the parameter ranges of sweep.json into the list of configurations to test.
+    # Each range is either a list of values or a {"start", "stop", "step"} dict (stop included).
+    values = {}
+    for name, param_range in param_ranges.items():
+        if isinstance(param_range, dict):
+            grid = np.arange(param_range["start"], param_range["stop"] + param_range["step"] / 2, param_range["step"])
+            # Keep integer parameters (durations, Martingale_max) as int.
+            if all(isinstance(param_range[k], int) for k in ("start", "stop", "step")):
+                values[name] = [int(v) for v in grid]
+            else:
+                values[name] = [round(float(v), 10) for v in grid]
+        else:
+            values[name] = list(param_range)
+
+    names = list(values)
+    grid = []
+    for combination in itertools.product(*(values[name] for name in names)):
+        params = dict(zip(names, combination))
+        if is_valid(params):
+            grid.append(params)
+    return grid
+
+def is_valid(params):
+    # Discard combinations that make no sense for the strategy.
+    if params.get("SMA_small_duration", 0) >= params.get("SMA_big_duration", float("inf")):
+        return False
+    if params.get("RSI_low", 0) >= params.get("RSI_high", float("inf")):
+        return False
+    if params.get("Martingale_max", 0) > 5: # Same limit enforced by get_config.
+        return False
+    return True
+
+def share_prices(historical_data):
+    # Copy the price columns once into a shared memory block, workers attach to it instead of
+    # receiving a pickled copy of the data with every task.
+    prices = historical_data[PRICE_COLUMNS].to_numpy(dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+    shared_prices = np.ndarray(prices.shape, dtype=np.float64, buffer=shm.buf)
+    shared_prices[:] = prices
+    return shm, prices.shape
+
+def init_worker(shm_name, shape, base_config, keep_trades=False):
+    # Attach to the shared prices and build a DataFrame view over them (no copy).
+    shm = shared_memory.SharedMemory(name=shm_name)
+    prices = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker["shm"] = shm # Keep a reference so the block stays mapped.
+    _worker["data"] = pd.DataFrame(prices, columns=PRICE_COLUMNS, copy=False)
+    _worker["config"] = base_config
+    _worker["keep_trades"] = keep_trades # Return the trade log of every run along with its summary.
+    # Backtest logging of thousands of runs is not useful, only warnings are logged by the workers.
+    logger.setup_worker()
+    logger.configure("WARNING")
+
+def run_config(params):
+    # Run one backtest with params applied on top of the base configuration.
+    # Return its summary and its trade log (None unless the worker keeps the trades).
+    config = dict(_worker["config"], **params)
+    _, trade_log = backtest_strategy(config, _worker["data"], vectorized=True)
+    summary = dict(params, **summarize(trade_log, _worker["data"]["close"].to_numpy(), config))
+    return summary, trade_log if _worker["keep_trades"] else None
+
+def summarize(trade_log, closes=None, config=None, start=0, end=None):
+    # Summary of a backtest run used to rank configurations. With the closes and config, the
+    # PnL statistics of the bars [start, end) are added (see accounting.py).
+    entries = trade_log.count("MKT")
+    tp_filled = trade_log.count("TP")
+    stop_outs = trade_log.count("STOP")
+    closed_at_end = trade_log.count("CLOSE")
+    fibo = trade_log.is_type("FIBO")
+    fibo_filled = int(fibo.sum())
+    max_ladder_depth = int(trade_log.levels[:len(trade_log)][fibo].max()) if fibo_filled else 0
+    summary = {
+        "entries": entries,
+        "tp_filled": tp_filled,
+        "fibo_filled": fibo_filled,
+        "max_ladder_depth": max_ladder_depth,
+        "stop_outs": stop_outs,
+        "closed_at_end": closed_at_end,
+        "open_at_end": entries > tp_filled + stop_outs + closed_at_end,
+    }
+    if closes is not None:
+        summary.update(backtest_statistics(closes, trade_log, parse_bar_size(config["barSizeSetting"]), start=start, end=end))
+    return summary
+
+def run_sweep(config, historical_data, param_ranges, processes=None, trades_path=None):
+    # Run backtest_strategy for every configuration of the grid across a process pool.
+    # Return the results ranked from best to worst.
+    # With trades_path, the trades of every run are written to one CSV or Parquet file (see trade_log.py),
+    # with a run column matching the run column of the results.
+    grid = expand_grid(param_ranges)
+    processes = processes or os.cpu_count()
+    print_strings(f"Running {len(grid)} configurations on {processes} processes...")
+
+    shm, shape = share_prices(historical_data)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(shm.name, shape, config, trades_path is not None)) as executor:
+            chunksize = max(1, len(grid) // (processes * 4))
+            runs = list(executor.map(run_config, grid, chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    print_strings("Sweep completed")
+    results = [summary for summary, _ in runs]
+    if trades_path is not None:
+        export_trades([trade_log for _, trade_log in runs], historical_data, trades_path)
+        results = [dict(summary, run=run) for run, summary in enumerate(results)]
+    return rank(pd.DataFrame(results))
+
+def export_trades(trade_logs, historical_data, path):
+    # Write the trades of every run to path in one go, numbered by run.
+    trades = concat(trade_logs)
+    if "date" in historical_data:
+        trades.dates = historical_data["date"].to_numpy()
+    runs = np.repeat(np.arange(len(trade_logs)), [len(trade_log) for trade_log in trade_logs])
+    print_strings(f"Trades of {len(trade_logs)} runs written to " + trades.export(path, run=runs))
+
+def rank(results):
+    # Rank backtest results from best to worst: by Sharpe ratio of the equity curve, then by
+    # completed take profit cycles, then prefer shallower ladders (less martingale exposure).
+    # Runs without trades (no Sharpe ratio) come last.
+    if results.empty:
+        return results
+    return results.sort_values(["sharpe", "tp_filled", "max_ladder_depth"], ascending=[False, False, True], na_position="last").reset_index(drop=True)
+
+
+def main(argv=None):
+    # Command line entry point. Return the process exit code.
+    parser = argparse.ArgumentParser(description="Backtest every configuration of the sweep.json grid.")
+    parser.add_argument("--config", default="config.json", help="configuration file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a configuration setting")
+    parser.add_argument("--host", help="IB Gateway host (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="IB Gateway port (default 7497)")
+    parser.add_argument("--client-id", type=int, help="IB client id (default 1)")
+    args = parser.parse_args(argv)
+
+    config = get_config(args.config, settings.parse_overrides(args.set)) # Read configuration parameters from config.json.
+    if config is None:
+        return 1
+    logger.configure(config.get("Log_level"))
+    myAccount, ib = boot_IB(args.host, args.port, args.client_id) # Get IB gateaway established.
+    if ib is None:
+        return 1
+    contract = get_contract(config)
+    if contract is None:
+        return 1
+    historical_data = get_data(config, ib, contract)
+    ib.disconnect()
+    if historical_data is None:
+        return 1
+    with open('sweep.json') as f:
+        param_ranges = json.load(f)
+    results = run_sweep(config, historical_data, param_ranges, trades_path=config.get("Sweep_trades_file") or None)
+    results.to_csv('sweep_results.csv', index=False)
+    print(results.head(20).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
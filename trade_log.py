@@ -0,0 +1,115 @@
+import numpy as np
+
+# Columnar record of the trades of a backtest. Trades are appended into preallocated typed arrays
+# (grown by doubling), so a backtest holds a handful of arrays instead of one dict per trade,
+# and the whole log is exported at once to CSV or Parquet (Parquet needs pyarrow or fastparquet).
+
+# Trade types, stored as their index. Even codes are BUY fills, odd codes SELL fills.
+# New types go at the end, the codes of the trade logs already exported stay valid.
+POSITIONS = np.array(["MKT_BUY", "MKT_SELL", "FIBO_BUY", "FIBO_SELL", "TP_BUY", "TP_SELL", "STOP_BUY", "STOP_SELL", "CLOSE_BUY", "CLOSE_SELL"])
+CODES = {position: code for code, position in enumerate(POSITIONS.tolist())}
+
+INITIAL_CAPACITY = 1024
+
+
+class TradeLog:
+    # Columns: step (bar index), position (trade type code), price, size and level. The level is 0 for
+    # the market order, the fibonacci level for a fibonacci order, and the number of fibonacci orders
+    # filled when the ladder is closed for a take profit, a stop-out or at the end of the run.
+    # dates are the bar dates of the backtest data (optional), used for the date column on export.
+    __slots__ = ("steps", "codes", "prices", "sizes", "levels", "length", "dates")
+
+    def __init__(self, dates=None, capacity=INITIAL_CAPACITY):
+        self.steps = np.empty(capacity, dtype=np.int64)
+        self.codes = np.empty(capacity, dtype=np.uint8)
+        self.prices = np.empty(capacity, dtype=np.float64)
+        self.sizes = np.empty(capacity, dtype=np.float64)
+        self.levels = np.empty(capacity, dtype=np.int8)
+        self.length = 0
+        self.dates = dates
+
+    def append(self, position, step, price, size, level):
+        if self.length == len(self.steps):
+            self._grow()
+        i = self.length
+        self.steps[i] = step
+        self.codes[i] = CODES[position]
+        self.prices[i] = price
+        self.sizes[i] = size
+        self.levels[i] = level
+        self.length += 1
+
+    def _grow(self):
+        for name in ("steps", "codes", "prices", "sizes", "levels"):
+            column = getattr(self, name)
+            grown = np.empty(max(2 * len(column), INITIAL_CAPACITY), dtype=column.dtype)
+            grown[:self.length] = column[:self.length]
+            setattr(self, name, grown)
+
+    def __getstate__(self):
+        # Only the filled part of the columns is pickled (logs returned by the sweep workers).
+        return self.columns(), self.dates
+
+    def __setstate__(self, state):
+        (self.steps, self.codes, self.prices, self.sizes, self.levels), self.dates = state
+        self.length = len(self.steps)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # One dict per trade, for inspection. Use the columns for anything else.
+        for i in range(self.length):
+            yield {"position": POSITIONS[self.codes[i]], "price": self.prices[i], "size": self.sizes[i], "step": int(self.steps[i]), "level": int(self.levels[i])}
+
+    def columns(self):
+        # The filled part of every column: steps, codes, prices, sizes, levels (views, no copy).
+        n = self.length
+        return self.steps[:n], self.codes[:n], self.prices[:n], self.sizes[:n], self.levels[:n]
+
+    def buys(self):
+        # True for the BUY fills.
+        return self.codes[:self.length] % 2 == 0
+
+    def is_type(self, kind):
+        # True for the trades of a kind: "MKT", "FIBO", "TP", "STOP" or "CLOSE".
+        return (self.codes[:self.length] == CODES[kind + "_BUY"]) | (self.codes[:self.length] == CODES[kind + "_SELL"])
+
+    def count(self, kind):
+        return int(self.is_type(kind).sum())
+
+    def to_frame(self):
+        import pandas as pd
+        steps, codes, prices, sizes, levels = self.columns()
+        frame = {}
+        if self.dates is not None:
+            frame["date"] = self.dates[steps]
+        frame.update({
+            "step": steps,
+            "position": pd.Categorical.from_codes(codes, categories=POSITIONS),
+            "price": prices,
+            "size": sizes,
+            "level": levels,
+        })
+        return pd.DataFrame(frame)
+
+    def export(self, path, **columns):
+        # Write the log to path, Parquet if it ends with .parquet, CSV otherwise.
+        # Extra columns (e.g. the parameters of a sweep run) are written with every trade.
+        frame = self.to_frame().assign(**columns)
+        if path.endswith(".parquet"):
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+        return path
+
+
+def concat(logs):
+    # One log with the trades of every log in order (e.g. the out-of-sample windows of a walk-forward).
+    # The dates of the first log are kept, the logs are expected to come from the same data.
+    if not logs:
+        return TradeLog()
+    combined = TradeLog(logs[0].dates, capacity=0)
+    combined.steps, combined.codes, combined.prices, combined.sizes, combined.levels = (np.concatenate(column) for column in zip(*(log.columns() for log in logs)))
+    combined.length = len(combined.steps)
+    return combined
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import sweep
+from backtest import backtest_strategy, print_strings, boot_IB, get_config, get_contract, get_data
+from indicators import compute_indicators, compute_signals
+from sweep import expand_grid, share_prices, summarize, rank
+from trade_log import TradeLog, concat
+import logger
+import settings
+
+# Walk-forward optimization: the sweep.json grid is tuned on rolling in-sample windows and the
+# best configuration of each window is traded on the out-of-sample window that follows it.
+# The out-of-sample windows follow each other, their trades are stitched into one trade log.
+#
+# Indicators only depend on a few parameters, so the grid is split into groups sharing them:
+# each worker computes the indicators of a group once over the whole dataset and runs every
+# configuration of the group on every in-sample window, slicing the same arrays.
+
+# Parameters the indicator arrays depend on.
+INDICATOR_KEYS = ["SMA_small_duration", "SMA_big_duration", "RSI_duration", "bolinger_band_duration", "bolinger_band_std_dev"]
+
+# Indicator arrays kept by each worker for the out-of-sample runs.
+INDICATOR_CACHE_SIZE = 8
+
+_indicators = {}
+
+
+def make_windows(n_bars, in_sample, out_of_sample):
+    # Rolling windows as (in-sample start, out-of-sample start, out-of-sample end) bar indices.
+    # Windows move by out_of_sample bars, so the out-of-sample windows cover the data without overlap.
+    windows = []
+    is_start = 0
+    while is_start + in_sample < n_bars:
+        oos_start = is_start + in_sample
+        windows.append((is_start, oos_start, min(oos_start + out_of_sample, n_bars)))
+        is_start += out_of_sample
+    return windows
+
+def indicator_key(config):
+    return tuple(config[name] for name in INDICATOR_KEYS)
+
+def group_grid(grid, base_config):
+    # Split the grid into groups of configurations sharing the same indicators.
+    groups = {}
+    for params in grid:
+        groups.setdefault(indicator_key(dict(base_config, **params)), []).append(params)
+    return list(groups.values())
+
+def get_indicators(config):
+    # Indicators of config over the worker dataset, from the worker cache when possible.
+    key = indicator_key(config)
+    if key not in _indicators:
+        if len(_indicators) >= INDICATOR_CACHE_SIZE:
+            _indicators.pop(next(iter(_indicators)))
+        _indicators[key] = compute_indicators(sweep._worker["data"], config)
+    return _indicators[key]
+
+def init_worker(shm_name, shape, base_config, windows):
+    sweep.init_worker(shm_name, shape, base_config)
+    sweep._worker["windows"] = windows
+
+def run_in_sample(group):
+    # Run every configuration of the group on every in-sample window.
+    # Return one (params, [summary of each window]) per configuration.
+    data = sweep._worker["data"]
+    closes = data["close"].to_numpy()
+    results = []
+    indicators = None
+    for params in group:
+        config = dict(sweep._worker["config"], **params)
+        if indicators is None:
+            indicators = compute_indicators(data, config)
+        signals = compute_signals(data, config, indicators)
+        summaries = []
+        for is_start, oos_start, _ in sweep._worker["windows"]:
+            _, trade_log = backtest_strategy(config, data, vectorized=True, start=is_start, end=oos_start, signals=signals)
+            summaries.append(summarize(trade_log, closes, config, start=is_start, end=oos_start))
+        results.append((params, summaries))
+    return results
+
+def run_out_of_sample(task):
+    # Trade the best configuration of a window on its out-of-sample bars.
+    window, params = task
+    _, oos_start, oos_end = sweep._worker["windows"][window]
+    data = sweep._worker["data"]
+    config = dict(sweep._worker["config"], **params)
+    signals = compute_signals(data, config, get_indicators(config))
+    _, trade_log = backtest_strategy(config, data, vectorized=True, start=oos_start, end=oos_end, signals=signals, close_at_end=True)
+    return trade_log
+
+def run_walk_forward(config, historical_data, param_ranges, in_sample, out_of_sample, processes=None):
+    # Walk-forward optimization of the param_ranges grid.
+    # Return the report (one row per window) and the stitched out-of-sample trade log.
+    windows = make_windows(len(historical_data), in_sample, out_of_sample)
+    if not windows:
+        print_strings("Not enough bars for one in-sample window")
+        return pd.DataFrame(), TradeLog()
+    groups = group_grid(expand_grid(param_ranges), config)
+    processes = processes or os.cpu_count()
+    print_strings(f"Running {len(windows)} windows, {sum(len(group) for group in groups)} configurations on {processes} processes...")
+
+    shm, shape = share_prices(historical_data)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(shm.name, shape, config, windows)) as executor:
+            # Tune: score every configuration on every in-sample window.
+            in_sample_results = [result for results in executor.map(run_in_sample, groups) for result in results]
+            best = []
+            for window in range(len(windows)):
+                ranked = rank(pd.DataFrame([dict(params, **summaries[window]) for params, summaries in in_sample_results]))
+                best.append(ranked.iloc[0])
+            print_strings("In-sample optimization completed")
+
+            # Trade the best configurations on the out-of-sample windows.
+            param_names = list(param_ranges)
+            tasks = [(window, {name: best[window][name] for name in param_names}) for window in range(len(windows))]
+            out_of_sample_logs = list(executor.map(run_out_of_sample, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    dates = historical_data["date"] if "date" in historical_data else pd.Series(historical_data.index)
+    closes = historical_data["close"].to_numpy()
+    report = []
+    for window, (is_start, oos_start, oos_end) in enumerate(windows):
+        row = {"window": window, "in_sample_start": dates.iloc[is_start], "out_of_sample_start": dates.iloc[oos_start], "out_of_sample_end": dates.iloc[oos_end - 1]}
+        row.update({name: best[window][name] for name in param_ranges})
+        row.update({f"is_{name}": value for name, value in best[window].items() if name not in param_ranges})
+        row.update({f"oos_{name}": value for name, value in summarize(out_of_sample_logs[window], closes, config, start=oos_start, end=oos_end).items()})
+        report.append(row)
+
+    trade_log = concat(out_of_sample_logs)
+    if "date" in historical_data:
+        trade_log.dates = historical_data["date"].to_numpy()
+    print_strings("Walk-forward completed")
+    return pd.DataFrame(report), trade_log
+
+
+def main(argv=None):
+    # Command line entry point. Return the process exit code.
+    parser = argparse.ArgumentParser(description="Walk-forward optimization of the sweep.json grid.")
+    parser.add_argument("--config", default="config.json", help="configuration file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a configuration setting")
+    parser.add_argument("--host", help="IB Gateway host (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="IB Gateway port (default 7497)")
+    parser.add_argument("--client-id", type=int, help="IB client id (default 1)")
+    args = parser.parse_args(argv)
+
+    config = get_config(args.config, settings.parse_overrides(args.set)) # Read configuration parameters from config.json.
+    if config is None:
+        return 1
+    logger.configure(config.get("Log_level"))
+    myAccount, ib = boot_IB(args.host, args.port, args.client_id) # Get IB gateaway established.
+    if ib is None:
+        return 1
+    contract = get_contract(config)
+    if contract is None:
+        return 1
+    historical_data = get_data(config, ib, contract)
+    ib.disconnect()
+    if historical_data is None:
+        return 1
+    with open('sweep.json') as f:
+        param_ranges = json.load(f)
+    report, trade_log = run_walk_forward(config, historical_data, param_ranges,
+                                         config["Walk_forward_in_sample"], config["Walk_forward_out_of_sample"])
+    report.to_csv('walk_forward_results.csv', index=False)
+    print(report.to_string())
+    print_strings(f"Out-of-sample: {summarize(trade_log)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())